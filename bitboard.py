@@ -0,0 +1,603 @@
+# -*- coding: utf-8 -*-
+
+"""
+bitboard.py
+Bitboard Position Representation and Move Generator
+"""
+
+import json
+import random
+
+starting_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+white, black = 0, 1
+pawn, knight, bishop, rook, queen, king = range(6)
+piece_symbols = "PNBRQKpnbrqk"
+promotion_symbols = " nbrq"
+en_passant_flag, castle_flag, double_push_flag = 1, 2, 3
+see_values = (100, 320, 330, 500, 900, 20000)
+
+full = 0xFFFFFFFFFFFFFFFF
+file_a = 0x0101010101010101
+file_h = file_a << 7
+rank_1 = 0xFF
+rank_8 = rank_1 << 56
+
+zobrist_random = random.Random(20220131)
+zobrist_pieces = [[zobrist_random.getrandbits(64) for _ in range(64)] for _ in range(12)]
+zobrist_castling = [zobrist_random.getrandbits(64) for _ in range(4)]
+zobrist_en_passant = [zobrist_random.getrandbits(64) for _ in range(8)]
+zobrist_turn = zobrist_random.getrandbits(64)
+zobrist_castling_rights = []
+for _rights in range(16):
+	_key = 0
+	for _bit in range(4):
+		if _rights & (1 << _bit):
+			_key ^= zobrist_castling[_bit]
+	zobrist_castling_rights.append(_key)
+
+
+def squareName(square):
+	return "abcdefgh"[square & 7] + str((square >> 3) + 1)
+
+
+def squareIndex(name):
+	return "abcdefgh".index(name[0]) + (int(name[1]) - 1) * 8
+
+
+def popCount(bitboard):
+	return bin(bitboard).count("1")
+
+
+def squares(bitboard):
+	while bitboard:
+		low = bitboard & -bitboard
+		yield low.bit_length() - 1
+		bitboard ^= low
+
+
+def _stepAttacks(steps):
+	table = []
+	for square in range(64):
+		attacks = 0
+		for file_step, rank_step in steps:
+			file, rank = (square & 7) + file_step, (square >> 3) + rank_step
+			if 0 <= file < 8 and 0 <= rank < 8:
+				attacks |= 1 << (rank * 8 + file)
+		table.append(attacks)
+	return table
+
+
+def _rays(file_step, rank_step):
+	table = []
+	for square in range(64):
+		attacks = 0
+		file, rank = (square & 7) + file_step, (square >> 3) + rank_step
+		while 0 <= file < 8 and 0 <= rank < 8:
+			attacks |= 1 << (rank * 8 + file)
+			file, rank = file + file_step, rank + rank_step
+		table.append(attacks)
+	return table
+
+
+knight_attacks = _stepAttacks([(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+king_attacks = _stepAttacks([(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)])
+pawn_attacks = [_stepAttacks([(-1, 1), (1, 1)]), _stepAttacks([(-1, -1), (1, -1)])]
+
+# Rays that run towards higher square indices find their first blocker with the lowest set bit, the others with the highest
+north, east, north_east, north_west = _rays(0, 1), _rays(1, 0), _rays(1, 1), _rays(-1, 1)
+south, west, south_west, south_east = _rays(0, -1), _rays(-1, 0), _rays(-1, -1), _rays(1, -1)
+rook_rays = [(north, True), (east, True), (south, False), (west, False)]
+bishop_rays = [(north_east, True), (north_west, True), (south_west, False), (south_east, False)]
+queen_lines = [north[i] | east[i] | south[i] | west[i] | north_east[i] | north_west[i] | south_west[i] | south_east[i] for i in range(64)]
+
+# Piece-square tables from white's side, rank 8 first as on a diagram; the middlegame and endgame sums are blended by the material left on the board
+middlegame_values = (100, 320, 330, 500, 900, 0)
+endgame_values = (120, 300, 320, 520, 950, 0)
+phase_weights = (0, 1, 1, 2, 4, 0)
+total_phase = 24
+middlegame_tables = (
+	(0, 0, 0, 0, 0, 0, 0, 0,
+	50, 50, 50, 50, 50, 50, 50, 50,
+	10, 10, 20, 30, 30, 20, 10, 10,
+	5, 5, 10, 25, 25, 10, 5, 5,
+	0, 0, 0, 20, 20, 0, 0, 0,
+	5, -5, -10, 0, 0, -10, -5, 5,
+	5, 10, 10, -20, -20, 10, 10, 5,
+	0, 0, 0, 0, 0, 0, 0, 0),
+	(-50, -40, -30, -30, -30, -30, -40, -50,
+	-40, -20, 0, 0, 0, 0, -20, -40,
+	-30, 0, 10, 15, 15, 10, 0, -30,
+	-30, 5, 15, 20, 20, 15, 5, -30,
+	-30, 0, 15, 20, 20, 15, 0, -30,
+	-30, 5, 10, 15, 15, 10, 5, -30,
+	-40, -20, 0, 5, 5, 0, -20, -40,
+	-50, -40, -30, -30, -30, -30, -40, -50),
+	(-20, -10, -10, -10, -10, -10, -10, -20,
+	-10, 0, 0, 0, 0, 0, 0, -10,
+	-10, 0, 5, 10, 10, 5, 0, -10,
+	-10, 5, 5, 10, 10, 5, 5, -10,
+	-10, 0, 10, 10, 10, 10, 0, -10,
+	-10, 10, 10, 10, 10, 10, 10, -10,
+	-10, 5, 0, 0, 0, 0, 5, -10,
+	-20, -10, -10, -10, -10, -10, -10, -20),
+	(0, 0, 0, 0, 0, 0, 0, 0,
+	5, 10, 10, 10, 10, 10, 10, 5,
+	-5, 0, 0, 0, 0, 0, 0, -5,
+	-5, 0, 0, 0, 0, 0, 0, -5,
+	-5, 0, 0, 0, 0, 0, 0, -5,
+	-5, 0, 0, 0, 0, 0, 0, -5,
+	-5, 0, 0, 0, 0, 0, 0, -5,
+	0, 0, 0, 5, 5, 0, 0, 0),
+	(-20, -10, -10, -5, -5, -10, -10, -20,
+	-10, 0, 0, 0, 0, 0, 0, -10,
+	-10, 0, 5, 5, 5, 5, 0, -10,
+	-5, 0, 5, 5, 5, 5, 0, -5,
+	0, 0, 5, 5, 5, 5, 0, -5,
+	-10, 5, 5, 5, 5, 5, 0, -10,
+	-10, 0, 5, 0, 0, 0, 0, -10,
+	-20, -10, -10, -5, -5, -10, -10, -20),
+	(-30, -40, -40, -50, -50, -40, -40, -30,
+	-30, -40, -40, -50, -50, -40, -40, -30,
+	-30, -40, -40, -50, -50, -40, -40, -30,
+	-30, -40, -40, -50, -50, -40, -40, -30,
+	-20, -30, -30, -40, -40, -30, -30, -20,
+	-10, -20, -20, -20, -20, -20, -20, -10,
+	20, 20, 0, 0, 0, 0, 20, 20,
+	20, 30, 10, 0, 0, 10, 30, 20)
+)
+endgame_tables = (
+	(0, 0, 0, 0, 0, 0, 0, 0,
+	80, 80, 80, 80, 80, 80, 80, 80,
+	50, 50, 50, 50, 50, 50, 50, 50,
+	30, 30, 30, 30, 30, 30, 30, 30,
+	20, 20, 20, 20, 20, 20, 20, 20,
+	10, 10, 10, 10, 10, 10, 10, 10,
+	0, 0, 0, 0, 0, 0, 0, 0,
+	0, 0, 0, 0, 0, 0, 0, 0),
+	middlegame_tables[1],
+	middlegame_tables[2],
+	(0,) * 64,
+	middlegame_tables[4],
+	(-50, -40, -30, -20, -20, -30, -40, -50,
+	-30, -20, -10, 0, 0, -10, -20, -30,
+	-30, -10, 20, 30, 30, 20, -10, -30,
+	-30, -10, 30, 40, 40, 30, -10, -30,
+	-30, -10, 30, 40, 40, 30, -10, -30,
+	-30, -10, 20, 30, 30, 20, -10, -30,
+	-30, -30, 0, 0, 0, 0, -30, -30,
+	-50, -30, -30, -30, -30, -30, -30, -50)
+)
+
+
+def _squareValues(values, tables):
+	# Indexed by piece and square, signed for white, so the running sums need one addition per piece moved
+	result = [[values[x] + tables[x][square ^ 56] for square in range(64)] for x in range(6)]
+	return result + [[-values[x] - tables[x][square] for square in range(64)] for x in range(6)]
+
+
+middlegame_squares = _squareValues(middlegame_values, middlegame_tables)
+endgame_squares = _squareValues(endgame_values, endgame_tables)
+piece_phases = phase_weights * 2
+
+
+def loadEvaluation(path):
+	"""Replace the material values and piece-square tables with those in a JSON file written by tune.py; positions created afterwards use them"""
+	global middlegame_values, endgame_values, middlegame_tables, endgame_tables
+	try:
+		with open(path) as file:
+			weights = json.load(file)
+		values = [tuple(int(x) for x in weights[y]) for y in ("middlegame_values", "endgame_values")]
+		tables = [tuple(tuple(int(x) for x in y) for y in weights[z]) for z in ("middlegame_tables", "endgame_tables")]
+	except (OSError, ValueError, KeyError, TypeError):
+		return False
+	if any(len(x) != 6 for x in values + tables) or any(len(y) != 64 for x in tables for y in x):
+		return False
+	(middlegame_values, endgame_values), (middlegame_tables, endgame_tables) = values, tables
+	middlegame_squares[:] = _squareValues(middlegame_values, middlegame_tables)
+	endgame_squares[:] = _squareValues(endgame_values, endgame_tables)
+	return True
+
+castling_masks = [15] * 64
+castling_masks[0], castling_masks[4], castling_masks[7] = 13, 12, 14
+castling_masks[56], castling_masks[60], castling_masks[63] = 7, 3, 11
+
+
+def slidingAttacks(square, occupied, rays):
+	attacks = 0
+	for ray, positive in rays:
+		ray_attacks = ray[square]
+		blockers = ray_attacks & occupied
+		if blockers:
+			if positive:
+				ray_attacks ^= ray[(blockers & -blockers).bit_length() - 1]
+			else:
+				ray_attacks ^= ray[blockers.bit_length() - 1]
+		attacks |= ray_attacks
+	return attacks
+
+
+def bishopAttacks(square, occupied):
+	return slidingAttacks(square, occupied, bishop_rays)
+
+
+def rookAttacks(square, occupied):
+	return slidingAttacks(square, occupied, rook_rays)
+
+
+def encodeMove(from_square, to_square, promotion=0, flag=0):
+	return from_square | (to_square << 6) | (promotion << 12) | (flag << 15)
+
+
+class Position:
+	def __init__(self, fen=starting_fen):
+		self.bitboards = [0] * 12
+		self.occupancy = [0, 0]
+		self.board = [-1] * 64
+		self.history = []
+		# Keys of the game positions before this one, oldest first, so repetitions of them count as draws too
+		self.earlier_keys = []
+		self.middlegame = self.endgame = self.phase = 0
+		fields = fen.split()
+		for x, y in enumerate(fields[0].split("/")):
+			file = 0
+			for z in y:
+				if z.isdigit():
+					file += int(z)
+				else:
+					self.putPiece(piece_symbols.index(z), (7 - x) * 8 + file)
+					file += 1
+		self.turn = white if len(fields) < 2 or fields[1] == "w" else black
+		self.castling = 0
+		if len(fields) > 2:
+			for i in fields[2]:
+				if i in "KQkq":
+					self.castling |= 1 << "KQkq".index(i)
+		self.en_passant = squareIndex(fields[3]) if len(fields) > 3 and fields[3] != "-" else -1
+		self.halfmove = int(fields[4]) if len(fields) > 4 else 0
+		self.fullmove = int(fields[5]) if len(fields) > 5 else 1
+		self.key = self.computeKey()
+
+	def putPiece(self, piece, square):
+		self.bitboards[piece] |= 1 << square
+		self.occupancy[piece // 6] |= 1 << square
+		self.board[square] = piece
+		self.middlegame += middlegame_squares[piece][square]
+		self.endgame += endgame_squares[piece][square]
+		self.phase += piece_phases[piece]
+
+	def computeKey(self):
+		key = 0
+		for square, piece in enumerate(self.board):
+			if piece >= 0:
+				key ^= zobrist_pieces[piece][square]
+		if self.turn == white:
+			key ^= zobrist_turn
+		key ^= zobrist_castling_rights[self.castling]
+		if self.en_passant >= 0:
+			key ^= zobrist_en_passant[self.en_passant & 7]
+		return key
+
+	def FEN(self):
+		rows = []
+		for rank in range(7, -1, -1):
+			row, empty = "", 0
+			for file in range(8):
+				piece = self.board[rank * 8 + file]
+				if piece < 0:
+					empty += 1
+					continue
+				if empty:
+					row += str(empty)
+					empty = 0
+				row += piece_symbols[piece]
+			rows.append(row + (str(empty) if empty else ""))
+		castling = "".join(x for y, x in enumerate("KQkq") if self.castling & (1 << y)) or "-"
+		en_passant = squareName(self.en_passant) if self.en_passant >= 0 else "-"
+		return " ".join(["/".join(rows), "wb"[self.turn], castling, en_passant, str(self.halfmove), str(self.fullmove)])
+
+	def kingSquare(self, color):
+		return self.bitboards[king + 6 * color].bit_length() - 1
+
+	def isAttacked(self, square, by_color):
+		offset = 6 * by_color
+		bitboards = self.bitboards
+		if pawn_attacks[by_color ^ 1][square] & bitboards[pawn + offset]:
+			return True
+		if knight_attacks[square] & bitboards[knight + offset]:
+			return True
+		if king_attacks[square] & bitboards[king + offset]:
+			return True
+		occupied = self.occupancy[0] | self.occupancy[1]
+		queens = bitboards[queen + offset]
+		if bishopAttacks(square, occupied) & (bitboards[bishop + offset] | queens):
+			return True
+		return bool(rookAttacks(square, occupied) & (bitboards[rook + offset] | queens))
+
+	def inCheck(self):
+		return self.isAttacked(self.kingSquare(self.turn), self.turn ^ 1)
+
+	def pseudoMoves(self):
+		moves = []
+		color = self.turn
+		offset = 6 * color
+		bitboards = self.bitboards
+		own, enemy = self.occupancy[color], self.occupancy[color ^ 1]
+		occupied = own | enemy
+		empty = ~occupied & full
+		pawns = bitboards[pawn + offset]
+		if color == white:
+			single = (pawns << 8) & empty
+			double = ((single & (rank_1 << 16)) << 8) & empty
+			left = ((pawns & ~file_a) << 7) & enemy
+			right = ((pawns & ~file_h) << 9) & enemy
+			push, left_step, right_step, promotion_rank = 8, 7, 9, rank_8
+		else:
+			single = (pawns >> 8) & empty
+			double = ((single & (rank_8 >> 16)) >> 8) & empty
+			left = ((pawns & ~file_a) >> 9) & enemy
+			right = ((pawns & ~file_h) >> 7) & enemy
+			push, left_step, right_step, promotion_rank = -8, -9, -7, rank_1
+		for targets, step in ((single, push), (left, left_step), (right, right_step)):
+			for to in squares(targets & promotion_rank):
+				for promotion in (4, 1, 3, 2):
+					moves.append(to - step | (to << 6) | (promotion << 12))
+			for to in squares(targets & ~promotion_rank):
+				moves.append(to - step | (to << 6))
+		for to in squares(double):
+			moves.append(to - 2 * push | (to << 6) | (double_push_flag << 15))
+		if self.en_passant >= 0:
+			for from_square in squares(pawn_attacks[color ^ 1][self.en_passant] & pawns):
+				moves.append(from_square | (self.en_passant << 6) | (en_passant_flag << 15))
+		targets = ~own & full
+		for from_square in squares(bitboards[knight + offset]):
+			for to in squares(knight_attacks[from_square] & targets):
+				moves.append(from_square | (to << 6))
+		for from_square in squares(bitboards[bishop + offset]):
+			for to in squares(bishopAttacks(from_square, occupied) & targets):
+				moves.append(from_square | (to << 6))
+		for from_square in squares(bitboards[rook + offset]):
+			for to in squares(rookAttacks(from_square, occupied) & targets):
+				moves.append(from_square | (to << 6))
+		for from_square in squares(bitboards[queen + offset]):
+			for to in squares((bishopAttacks(from_square, occupied) | rookAttacks(from_square, occupied)) & targets):
+				moves.append(from_square | (to << 6))
+		king_square = self.kingSquare(color)
+		for to in squares(king_attacks[king_square] & targets):
+			moves.append(king_square | (to << 6))
+		if self.castling & (3 << (2 * color)) and not self.isAttacked(king_square, color ^ 1):
+			base = 56 * color
+			if self.castling & (1 << (2 * color)) and not occupied & (0x60 << base) and not self.isAttacked(base + 5, color ^ 1):
+				moves.append(base + 4 | ((base + 6) << 6) | (castle_flag << 15))
+			if self.castling & (2 << (2 * color)) and not occupied & (0x0E << base) and not self.isAttacked(base + 3, color ^ 1):
+				moves.append(base + 4 | ((base + 2) << 6) | (castle_flag << 15))
+		return moves
+
+	def moves(self, noisy=False):
+		color = self.turn
+		king_square = self.kingSquare(color)
+		king_lines = queen_lines[king_square]
+		in_check = self.isAttacked(king_square, color ^ 1)
+		legal = []
+		for move in self.pseudoMoves():
+			from_square = move & 63
+			# Captures and promotions only, for the quiescence search
+			if noisy and self.board[(move >> 6) & 63] < 0 and not (move >> 12) & 7 and move >> 15 != en_passant_flag:
+				continue
+			# A piece off every line through its king cannot be pinned, so the move is legal unless the king is already in check
+			if not in_check and from_square != king_square and not (king_lines >> from_square) & 1 and move >> 15 != en_passant_flag:
+				legal.append(move)
+				continue
+			self.make(move)
+			if not self.isAttacked(self.kingSquare(color), color ^ 1):
+				legal.append(move)
+			self.unmake()
+		return legal
+
+	def attackersTo(self, square, occupied):
+		bitboards = self.bitboards
+		diagonal = bitboards[bishop] | bitboards[queen] | bitboards[bishop + 6] | bitboards[queen + 6]
+		straight = bitboards[rook] | bitboards[queen] | bitboards[rook + 6] | bitboards[queen + 6]
+		attackers = (pawn_attacks[black][square] & bitboards[pawn]) | (pawn_attacks[white][square] & bitboards[pawn + 6])
+		attackers |= knight_attacks[square] & (bitboards[knight] | bitboards[knight + 6])
+		attackers |= king_attacks[square] & (bitboards[king] | bitboards[king + 6])
+		attackers |= bishopAttacks(square, occupied) & diagonal
+		attackers |= rookAttacks(square, occupied) & straight
+		return attackers & occupied
+
+	def mvvLva(self, move):
+		"""Capture ordering value, most valuable victim first and then least valuable attacker, or None for quiet moves"""
+		to, promotion = (move >> 6) & 63, (move >> 12) & 7
+		if move >> 15 == en_passant_flag:
+			victim = pawn
+		elif self.board[to] >= 0:
+			victim = self.board[to] % 6
+		elif promotion:
+			victim = -1
+		else:
+			return None
+		return 8 * (victim + 1) - self.board[move & 63] % 6 + 8 * promotion
+
+	def see(self, move):
+		"""Static exchange evaluation: material won by the capture sequence on the target square, each side recapturing with its least valuable piece"""
+		from_square, to = move & 63, (move >> 6) & 63
+		if move >> 15 == en_passant_flag:
+			gain = [see_values[pawn]]
+		else:
+			gain = [see_values[self.board[to] % 6] if self.board[to] >= 0 else 0]
+		attacker_value = see_values[self.board[from_square] % 6]
+		attacker = 1 << from_square
+		occupied = self.occupancy[0] | self.occupancy[1]
+		color = self.turn
+		while True:
+			gain.append(attacker_value - gain[-1])
+			if max(-gain[-2], gain[-1]) < 0:
+				break
+			occupied ^= attacker
+			color ^= 1
+			attackers = self.attackersTo(to, occupied) & self.occupancy[color]
+			if not attackers:
+				break
+			for piece in range(6):
+				candidates = self.bitboards[piece + 6 * color] & attackers
+				if candidates:
+					attacker = candidates & -candidates
+					attacker_value = see_values[piece]
+					break
+		# The last entry assumes a recapture that never happens
+		gain.pop()
+		while len(gain) > 1:
+			value = gain.pop()
+			gain[-1] = -max(-gain[-1], value)
+		return gain[0]
+
+	def removePiece(self, piece, square):
+		self.bitboards[piece] ^= 1 << square
+		self.occupancy[piece // 6] ^= 1 << square
+		self.board[square] = -1
+		self.middlegame -= middlegame_squares[piece][square]
+		self.endgame -= endgame_squares[piece][square]
+		self.phase -= piece_phases[piece]
+
+	def make(self, move):
+		from_square, to = move & 63, (move >> 6) & 63
+		promotion, flag = (move >> 12) & 7, move >> 15
+		piece = self.board[from_square]
+		captured = self.board[to]
+		self.history.append((move, captured, self.castling, self.en_passant, self.halfmove, self.key))
+		key = self.key ^ zobrist_turn ^ zobrist_castling_rights[self.castling]
+		if self.en_passant >= 0:
+			key ^= zobrist_en_passant[self.en_passant & 7]
+		if captured >= 0:
+			self.removePiece(captured, to)
+			key ^= zobrist_pieces[captured][to]
+		self.removePiece(piece, from_square)
+		key ^= zobrist_pieces[piece][from_square]
+		if promotion:
+			self.putPiece(piece + promotion, to)
+			key ^= zobrist_pieces[piece + promotion][to]
+		else:
+			self.putPiece(piece, to)
+			key ^= zobrist_pieces[piece][to]
+		self.en_passant = -1
+		if flag == en_passant_flag:
+			captured_square = to - 8 if self.turn == white else to + 8
+			captured = self.board[captured_square]
+			self.removePiece(captured, captured_square)
+			key ^= zobrist_pieces[captured][captured_square]
+		elif flag == double_push_flag:
+			self.en_passant = (from_square + to) >> 1
+			key ^= zobrist_en_passant[self.en_passant & 7]
+		elif flag == castle_flag:
+			rook_from, rook_to = (to + 1, to - 1) if to > from_square else (to - 2, to + 1)
+			rook_piece = self.board[rook_from]
+			self.removePiece(rook_piece, rook_from)
+			self.putPiece(rook_piece, rook_to)
+			key ^= zobrist_pieces[rook_piece][rook_from] ^ zobrist_pieces[rook_piece][rook_to]
+		self.castling &= castling_masks[from_square] & castling_masks[to]
+		key ^= zobrist_castling_rights[self.castling]
+		if piece % 6 == pawn or captured >= 0:
+			self.halfmove = 0
+		else:
+			self.halfmove += 1
+		if self.turn == black:
+			self.fullmove += 1
+		self.turn ^= 1
+		self.key = key
+
+	def makeNull(self):
+		"""Pass the turn without moving, for null-move pruning; undone by unmake"""
+		self.history.append((None, -1, self.castling, self.en_passant, self.halfmove, self.key))
+		key = self.key ^ zobrist_turn
+		if self.en_passant >= 0:
+			key ^= zobrist_en_passant[self.en_passant & 7]
+		self.en_passant = -1
+		self.halfmove += 1
+		if self.turn == black:
+			self.fullmove += 1
+		self.turn ^= 1
+		self.key = key
+
+	def isDraw(self):
+		"""Fifty-move rule, or a repetition of a position since the last capture or pawn move"""
+		if self.halfmove >= 100:
+			return True
+		for index in range(len(self.history) - 2, len(self.history) - self.halfmove - 1, -2):
+			if index < -len(self.earlier_keys):
+				break
+			if (self.history[index][5] if index >= 0 else self.earlier_keys[index]) == self.key:
+				return True
+		return False
+
+	def hasPieces(self, color):
+		return bool(self.occupancy[color] & ~(self.bitboards[pawn + 6 * color] | self.bitboards[king + 6 * color]))
+
+	def unmake(self):
+		move, captured, self.castling, self.en_passant, self.halfmove, self.key = self.history.pop()
+		self.turn ^= 1
+		if self.turn == black:
+			self.fullmove -= 1
+		if move is None:
+			return
+		from_square, to = move & 63, (move >> 6) & 63
+		promotion, flag = (move >> 12) & 7, move >> 15
+		piece = self.board[to]
+		self.removePiece(piece, to)
+		self.putPiece(piece - promotion, from_square)
+		if captured >= 0:
+			self.putPiece(captured, to)
+		if flag == en_passant_flag:
+			if self.turn == white:
+				self.putPiece(pawn + 6, to - 8)
+			else:
+				self.putPiece(pawn, to + 8)
+		elif flag == castle_flag:
+			rook_from, rook_to = (to + 1, to - 1) if to > from_square else (to - 2, to + 1)
+			rook_piece = self.board[rook_to]
+			self.removePiece(rook_piece, rook_to)
+			self.putPiece(rook_piece, rook_from)
+
+	def evaluate(self):
+		# Promotions can take the phase past its starting value, which still counts as a full middlegame
+		phase = min(self.phase, total_phase)
+		score = (self.middlegame * phase + self.endgame * (total_phase - phase)) // total_phase
+		return score if self.turn == white else -score
+
+	@staticmethod
+	def encodeMove(move):
+		return move & 32767
+
+	@staticmethod
+	def moveName(move):
+		return squareName(move & 63) + squareName((move >> 6) & 63) + promotion_symbols[(move >> 12) & 7].strip()
+
+	def parseMove(self, name):
+		for i in self.moves():
+			if self.moveName(i) == name:
+				return i
+		return None
+
+	def parseSAN(self, name):
+		name = name.rstrip("+#!?").replace("0", "O")
+		if name in ("O-O", "O-O-O"):
+			for i in self.moves():
+				if i >> 15 == castle_flag and ((i >> 6) & 7) == (6 if name == "O-O" else 2):
+					return i
+			return None
+		promotion = 0
+		if not name:
+			return None
+		if name[-1] in "NBRQ":
+			promotion = promotion_symbols.index(name[-1].lower())
+			name = name[:-1].rstrip("=")
+		piece = "PNBRQK".index(name[0]) if name[0] in "NBRQK" else pawn
+		if piece != pawn:
+			name = name[1:]
+		if len(name) < 2 or name[-2] not in "abcdefgh" or name[-1] not in "12345678":
+			return None
+		to_square = squareIndex(name[-2:])
+		qualifier = name[:-2].replace("x", "")
+		for i in self.moves():
+			if (i >> 6) & 63 == to_square and self.board[i & 63] % 6 == piece and (i >> 12) & 7 == promotion and all(x in squareName(i & 63) for x in qualifier):
+				return i
+		return None
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+book.py
+Opening Book Index
+"""
+
+import os
+import re
+import random
+import marshal
+import hashlib
+
+import bitboard
+
+move_number = re.compile(r"^\d+\.+")
+
+# Bump when the compiled format or the position keys change, so old cache files are rebuilt
+cache_version = 2
+cache_path = "openings.cache"
+
+
+def parseMoveList(text):
+	moves = []
+	for i in text.split():
+		i = move_number.sub("", i)
+		if i:
+			moves.append(i)
+	return moves
+
+
+def positionKey(position):
+	# The en passant square is left out so that move orders reaching the same position share an entry
+	if position.en_passant >= 0:
+		return position.key ^ bitboard.zobrist_en_passant[position.en_passant & 7]
+	return position.key
+
+
+class OpeningBook:
+	"""Opening moves indexed by position key, so a lookup is one dict access instead of a scan of the opening lists"""
+	def __init__(self):
+		self.positions = {}
+
+	def addLine(self, moves, candidates):
+		position = bitboard.Position()
+		for i in moves:
+			move = position.parseSAN(i)
+			if move is None:
+				return False
+			position.make(move)
+		entry = {}
+		for x, y in candidates.items():
+			move = position.parseSAN(x)
+			if move is not None:
+				entry[position.moveName(move)] = y
+		if entry:
+			self.positions[positionKey(position)] = entry
+		return bool(entry)
+
+	def addWeightedLines(self, lines):
+		for x, y in lines.items():
+			self.addLine(parseMoveList(x), y)
+
+	def addECOLines(self, lines):
+		tree = {}
+		for i in lines:
+			node = tree
+			for move in parseMoveList(i["moves"]):
+				node = node.setdefault(move, {})
+		weighted = set(self.positions)
+		self.addTree(bitboard.Position(), tree, weighted)
+
+	def addTree(self, position, tree, weighted):
+		# Shared prefixes are replayed once, and positions given hand weights keep only those moves
+		key = positionKey(position)
+		for x, y in tree.items():
+			move = position.parseSAN(x)
+			if move is None:
+				continue
+			if key not in weighted:
+				self.positions.setdefault(key, {}).setdefault(position.moveName(move), 1)
+			if y:
+				position.make(move)
+				self.addTree(position, y, weighted)
+				position.unmake()
+
+	def moves(self, fen):
+		return self.positions.get(positionKey(bitboard.Position(fen)), {})
+
+	def choose(self, fen):
+		moves = self.moves(fen)
+		if not moves:
+			return None
+		return random.choices(population=list(moves), weights=list(moves.values()))[0]
+
+
+class OpeningNames:
+	"""ECO names by piece placement, with bounds past which no position in the list can occur"""
+	def __init__(self, lines=()):
+		self.names = {}
+		self.max_ply = 0
+		self.min_pieces = 32
+		for i in lines:
+			self.names.setdefault(i["position"], i["eco"] + " " + i["name"])
+			self.max_ply = max(self.max_ply, len(parseMoveList(i["moves"])))
+			self.min_pieces = min(self.min_pieces, sum(x.isalpha() for x in i["position"]))
+
+	def name(self, placement):
+		return self.names.get(placement)
+
+	def lookup(self, game):
+		if len(game.raw_move_list) > self.max_ply or len(game.pieces) < self.min_pieces:
+			return None
+		return self.names.get(game.FEN().split()[0])
+
+
+def sourceDigest(*sources):
+	return hashlib.sha1(repr((cache_version,) + sources).encode()).hexdigest()
+
+
+def readCache():
+	# marshal only reads plain values, so a tampered cache file cannot run code the way a pickle could
+	try:
+		with open(cache_path, "rb") as file:
+			cache = marshal.load(file)
+	except (OSError, EOFError, ValueError, TypeError):
+		return {}
+	if not isinstance(cache, dict) or cache.get("version") != cache_version:
+		return {}
+	return cache
+
+
+def writeCache(section, digest, data):
+	cache = readCache()
+	cache["version"] = cache_version
+	cache[section] = (digest, data)
+	try:
+		with open(cache_path + ".tmp", "wb") as file:
+			marshal.dump(cache, file)
+		os.replace(cache_path + ".tmp", cache_path)
+	except OSError:
+		pass
+
+
+def loadCached(section, sources, build):
+	# Compiled opening data is kept on disk and reused until the source data it was built from changes
+	digest = sourceDigest(*sources)
+	cached = readCache().get(section)
+	if isinstance(cached, tuple) and len(cached) == 2 and cached[0] == digest:
+		return cached[1]
+	data = build()
+	writeCache(section, digest, data)
+	return data
+
+
+opening_book = opening_names = None
+
+
+def getOpeningBook(weighted_lines, eco_lines):
+	global opening_book
+	if opening_book is None:
+		def build():
+			compiled = OpeningBook()
+			compiled.addWeightedLines(weighted_lines)
+			compiled.addECOLines(eco_lines)
+			return compiled.positions
+		opening_book = OpeningBook()
+		opening_book.positions = loadCached("book", (weighted_lines, eco_lines), build)
+	return opening_book
+
+
+def getOpeningNames(lines):
+	global opening_names
+	if opening_names is None:
+		def build():
+			compiled = OpeningNames(lines)
+			return compiled.names, compiled.max_ply, compiled.min_pieces
+		opening_names = OpeningNames()
+		opening_names.names, opening_names.max_ply, opening_names.min_pieces = loadCached("names", (lines,), build)
+	return opening_names
@@ -5,12 +5,22 @@ computer.py
 Player-vs-computer game mode
 """
 
+import os
 import json
+import time
 import random
-import subprocess
+import threading
 
+import book
 import board
 import chess
+import uci
+import nnue
+import engine
+import bitboard
+import timemanager
+import polyglot
+import syzygy
 import asyncio
 
 from PyQt5.QtGui import *
@@ -182,6 +192,13 @@ openings = {
 }
 
 
+computer_levels = {
+	1: {"depth": 2, "time": 1},
+	2: {"depth": 4, "time": 3},
+	3: {"depth": 64, "time": 10, "network": True}
+}
+
+
 def getMinutesSeconds(seconds):
 	if seconds < 60:
 		return 0, seconds
@@ -265,15 +282,12 @@ class Clock(QPushButton):
 		super(Clock, self).__init__(parent=parent)
 		self.timeup_function = timeup_function
 		self.time_control = time_control
-		if time_control.endswith("+0s"):
-			self.clock_minutes = int(time_control[:time_control.index(".")])
-			self.clock_seconds = round(6 * float(time_control[time_control.index(".") + 1:time_control.index("+") - 1]))
-		elif "+" in time_control:
-			self.clock_minutes = int(float(time_control[:time_control.index("+") - 1]))
-			self.clock_seconds = round(6 * float(time_control[time_control.index(".") + 1:time_control.index("+") - 1]))
-		else:
-			self.clock_minutes = getMinutesSeconds(int(time_control[:-1]))[0]
-			self.clock_seconds = getMinutesSeconds(int(time_control[:-1]))[1]
+		base, _, move_time = timemanager.parseTimeControl(time_control)
+		# The time left is kept in milliseconds and measured with a monotonic timer, the minutes and seconds shown are derived from it
+		self.initial = base if move_time is None else move_time
+		self.remaining = self.initial
+		self.elapsed = QElapsedTimer()
+		self.clock_minutes, self.clock_seconds = getMinutesSeconds(-(-self.remaining // 1000))
 		self.updateText()
 		self.running = False
 		self.timer = QTimer()
@@ -286,30 +300,38 @@ class Clock(QPushButton):
 		self.setText(str(self.clock_minutes) + ":" + str(self.clock_seconds).rjust(2, "0"))
 
 	def start(self):
-		self.timer.start(1000)
+		self.elapsed.start()
+		self.timer.start(100)
 		self.running = True
 
 	def pause(self):
+		self.remaining = self.remainingTime()
 		self.timer.stop()
 		self.running = False
 
+	def remainingTime(self):
+		if self.running:
+			return max(self.remaining - self.elapsed.elapsed(), 0)
+		return self.remaining
+
+	def addTime(self, milliseconds):
+		self.remaining += milliseconds
+		self.updateClock()
+
 	def updateClock(self):
-		if self.clock_seconds == 0:
-			if self.clock_minutes == 0:
-				if self.timeup_function is not None:
-					self.timeup_function(self)
-				self.pause()
-				return
-			self.clock_seconds = 59
-			self.clock_minutes -= 1
-		else:
-			self.clock_seconds -= 1
+		remaining = self.remainingTime()
+		self.clock_minutes, self.clock_seconds = getMinutesSeconds(-(-remaining // 1000))
 		self.updateText()
+		if remaining <= 0 and self.running:
+			if self.timeup_function is not None:
+				self.timeup_function(self)
+			self.pause()
 
 	def resetClock(self):
 		if "+" not in self.time_control:
-			self.clock_minutes = getMinutesSeconds(int(self.time_control[:-1]) + 1)[0]
-			self.clock_seconds = getMinutesSeconds(int(self.time_control[:-1]) + 1)[1]
+			self.remaining = self.initial
+			if self.running:
+				self.elapsed.restart()
 			self.updateClock()
 
 
@@ -323,17 +345,20 @@ class TakebackButton(QPushButton):
 	def mouseReleaseEvent(self, event) -> None:
 		if not self.parent().game.raw_move_list:
 			return
+		self.parent().stopPondering()
 		if self.parent().computer_moving:
 			if self.parent().engine is not None:
-				self.parent().engine.stdin.write("stop\n")
+				self.parent().discard_engine_moves += 1
+				self.parent().engine.send("stop")
 			else:
-				self.parent().get_computer_move_thread.quit()
-				self.parent().get_computer_move_runner.deleteLater()
-				self.parent().get_computer_move_thread.deleteLater()
+				self.parent().cancelSearch()
 			self.parent().computer_moving = False
 		else:
 			self.parent().game.takeback()
 		self.parent().game.takeback()
+		del self.parent().position_keys[len(self.parent().game.raw_move_list) + 1:]
+		if self.parent().engine_session is not None:
+			self.parent().engine_session.truncate(len(self.parent().game.raw_move_list))
 		self.parent().board.updatePieces()
 		asyncio.get_event_loop().run_until_complete(self.parent().updateTakebackOpening())
 		if self.parent().clocks[0].running:
@@ -349,21 +374,126 @@ class TakebackButton(QPushButton):
 		super(TakebackButton, self).mouseReleaseEvent(event)
 
 
+class AnalysisPanel(QLabel):
+	"""Engine output, redrawn at a fixed rate so a fast engine cannot flood the event loop with info lines"""
+	info = pyqtSignal(dict)
+
+	def __init__(self, parent, refresh_interval=100):
+		super(AnalysisPanel, self).__init__(parent)
+		self.setWordWrap(True)
+		self.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+		self.setFont(QFont(QFontDatabase.applicationFontFamilies(QFontDatabase.addApplicationFont(QDir.currentPath() + "/fonts/ChakraPetch-Regular.ttf"))[0], 12))
+		self.white = True
+		self.status = {}
+		self.lines = {}
+		self.changed = False
+		# The built-in search reports from its own thread, so its info is queued to the panel through this signal
+		self.info.connect(self.addInfo)
+		self.timer = QTimer(self)
+		self.timer.timeout.connect(self.refresh)
+		self.timer.start(refresh_interval)
+
+	def start(self, white):
+		self.white = white
+		self.status, self.lines = {}, {}
+		self.changed = True
+
+	def addInfo(self, info):
+		if "pv" in info and "score" in info:
+			self.lines[info.get("multipv", 1)] = info
+		for i in ["depth", "seldepth", "nodes", "nps", "time"]:
+			if i in info:
+				self.status[i] = info[i]
+		self.changed = True
+
+	def formatScore(self, score):
+		kind, value = score
+		if not self.white:
+			value = -value
+		if kind == "mate":
+			return ("#" if value > 0 else "#-") + str(abs(value))
+		return "{:+.2f}".format(value / 100)
+
+	def refresh(self):
+		if not self.changed:
+			return
+		self.changed = False
+		status, lines = dict(self.status), dict(self.lines)
+		text = []
+		if status:
+			text.append("Depth " + str(status.get("depth", 0)) + ("/" + str(status["seldepth"]) if "seldepth" in status else "") + "   " + str(status.get("nps", 0) // 1000) + " knps")
+		for x, y in sorted(lines.items()):
+			text.append(str(x) + ". " + self.formatScore(y["score"]) + "  " + " ".join(y["pv"][:12]))
+		self.setText("\n".join(text))
+
+
+class SearchStatistics(QObject):
+	"""Per-iteration statistics of the built-in search, handed over to the GUI thread and appended to one JSONL log per game"""
+	iteration = pyqtSignal(dict)
+
+	def __init__(self, parent, log_directory=""):
+		super(SearchStatistics, self).__init__(parent)
+		self.log_directory = log_directory
+		self.log = None
+		self.iteration.connect(self.write)
+
+	def add(self, info, ply):
+		# Called from the search thread, so the dictionary is copied and the writing is left to the queued slot
+		statistics = {x: info[x] for x in ["depth", "nodes", "qnodes", "nps", "time", "tt_probes", "tt_hits", "cutoffs", "first_move_cutoffs", "branching"] if x in info}
+		statistics["ply"] = ply
+		self.iteration.emit(statistics)
+
+	def write(self, statistics):
+		if not self.log_directory:
+			return
+		if self.log is None:
+			try:
+				os.makedirs(self.log_directory, exist_ok=True)
+				self.log = open(os.path.join(self.log_directory, time.strftime("game-%Y%m%d-%H%M%S") + ".jsonl"), "a")
+			except OSError:
+				self.log_directory = ""
+				return
+		self.log.write(json.dumps(statistics) + "\n")
+		self.log.flush()
+
+	def close(self):
+		if self.log is not None:
+			self.log.close()
+			self.log = None
+
+
+class StatisticsPanel(QLabel):
+	def __init__(self, parent):
+		super(StatisticsPanel, self).__init__(parent)
+		self.setWordWrap(True)
+		self.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+		self.setFont(QFont(QFontDatabase.applicationFontFamilies(QFontDatabase.addApplicationFont(QDir.currentPath() + "/fonts/ChakraPetch-Regular.ttf"))[0], 12))
+
+	def showStatistics(self, statistics):
+		nodes = statistics.get("nodes", 0)
+		text = ["Depth " + str(statistics.get("depth", 0)) + "   " + str(nodes) + " nodes (" + str(round(100 * statistics.get("qnodes", 0) / nodes) if nodes else 0) + "% quiescence)   " + str(statistics.get("nps", 0) // 1000) + " knps"]
+		text.append("Hash hits " + str(round(100 * statistics.get("tt_hits", 0) / statistics["tt_probes"]) if statistics.get("tt_probes") else 0) + "%   First move cutoffs " + str(round(100 * statistics.get("first_move_cutoffs", 0) / statistics["cutoffs"]) if statistics.get("cutoffs") else 0) + "%   Branching " + "{:.2f}".format(statistics.get("branching", 0)))
+		self.setText("\n".join(text))
+
+
 class Thread(QObject):
 	finished = pyqtSignal()
-	output = pyqtSignal(str)
+	output = pyqtSignal(str, str, int)
 
-	def __init__(self, function):
+	def __init__(self, function, generation=0):
 		super(Thread, self).__init__()
 		self.function = function
+		self.generation = generation
 
 	def run(self):
 		result = self.function()
 		self.finished.emit()
 		if type(result) == dict:
-			self.output.emit(result["move"])
+			self.output.emit(result["move"], result.get("ponder", ""), self.generation)
 		else:
-			self.output.emit(result)
+			self.output.emit(result, "", self.generation)
+		# Quitting from inside the thread lets QThread.wait return even while the GUI thread is blocked in it
+		QThread.currentThread().quit()
 
 
 class Computer(QWidget):
@@ -375,6 +505,7 @@ class Computer(QWidget):
 		self.settings_values = json.load(open("settings.json"))
 		self.game = None
 		self.time_control = None
+		self.time_manager = timemanager.TimeManager(None, self.settings_values["engine-move-time"] * 1000)
 		self.game_over = False
 		self.animation = QPropertyAnimation(self, b"pos")
 		self.animation.setEndValue(QPoint())
@@ -391,6 +522,8 @@ class Computer(QWidget):
 		self.opening.setWordWrap(True)
 		self.opening.setFont(QFont(QFontDatabase.applicationFontFamilies(QFontDatabase.addApplicationFont(QDir.currentPath() + "/fonts/ChakraPetch-Bold.ttf"))[0], 17, italic=True))
 		self.opening.resize(QSize(300, 50))
+		self.opening_labels = ["Starting Position"]
+		self.position_keys = []
 		self.moves = QWidget()
 		self.moves_layout = QGridLayout()
 		self.moves_layout.setAlignment(Qt.AlignTop | Qt.AlignLeft)
@@ -403,7 +536,17 @@ class Computer(QWidget):
 		self.moves_wrapper.setWidget(self.moves)
 		self.takeback = TakebackButton(self)
 		self.game_over_label = self.game_result_label = None
+		self.analysis = AnalysisPanel(self)
+		if not self.settings_values["engine-analysis"]:
+			self.analysis.hide()
+		self.statistics = SearchStatistics(self, self.settings_values["search-log-directory"])
+		self.statistics_panel = StatisticsPanel(self)
+		self.statistics.iteration.connect(self.statistics_panel.showStatistics)
+		if not self.settings_values["engine-statistics"]:
+			self.statistics_panel.hide()
 		self.sidebar_layout.addWidget(self.uci_process)
+		self.sidebar_layout.addWidget(self.analysis)
+		self.sidebar_layout.addWidget(self.statistics_panel)
 		self.sidebar_layout.addWidget(self.moves_wrapper)
 		self.sidebar.setLayout(self.sidebar_layout)
 		self.back_button = BackButton(self)
@@ -411,61 +554,73 @@ class Computer(QWidget):
 		self.sidebar.move(QPoint((self.width() // 2) + 400, 100))
 		self.temporary_move = None
 		self.setFocusPolicy(Qt.NoFocus)
-		self.get_computer_move_thread = self.get_computer_move_runner = None
+		self.search_threads = []
+		self.search_generation = 0
+		self.search_stop = None
+		self.transposition_table = self.search_pool = None
+		self.polyglot_book = None
+		self.tablebases = None
 		self.computer_moving = False
 		self.uci_identification = QLabel(self)
-		self.engine = self.engine_properties = None
+		self.engine = self.engine_session = None
+		self.engine_pondering = False
+		self.discard_engine_moves = 0
+		self.ponder_move = self.ponder_search = self.ponder_fen = None
 		self.variant = "Standard"
 
 	def setTimeControl(self, time_control):
 		if time_control == "unlimited":
 			return
 		self.time_control = time_control
+		self.time_manager = timemanager.TimeManager(time_control)
 		self.clocks.append(Clock(self, self.time_control, self.timeout))
 		self.clocks[0].move(QPoint(self.width() - self.clocks[0].width(), self.height() - self.clocks[0].height()))
 		self.clocks.append(Clock(self, self.time_control, self.timeout))
 		self.clocks[1].move(QPoint(self.width() - self.clocks[1].width(), 20))
 
-	async def getEngineResponse(self):
-		self.engine.stdin.write("isready\n")
-		response = ""
-		while True:
-			text = self.engine.stdout.readline().strip()
-			if text == "readyok":
-				break
-			elif text:
-				response += text + "\n"
-		return response
-
-	async def getEngineMove(self):
-		response = ""
-		while True:
-			text = self.engine.stdout.readline().strip()
-			response += text + "\n"
-			if text.startswith("bestmove "):
-				break
-		return response
+	def getGoCommand(self):
+		if not self.clocks:
+			return self.time_manager.goCommand()
+		return self.time_manager.goCommand(self.clocks[0].remainingTime(), self.clocks[1].remainingTime())
 
 	def setupUCI(self, path):
 		self.uci_process.show()
-		self.engine = subprocess.Popen(path, universal_newlines=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=1)
-		print(asyncio.get_event_loop().run_until_complete(self.getEngineResponse()))
-		self.uci_process.setText("Connected to engine, preparing communication with engine...")
-		self.engine.stdin.write("uci\n")
-		self.engine_properties = asyncio.get_event_loop().run_until_complete(self.getEngineResponse())
-		found_name = found_authors = False
-		for i in self.engine_properties.splitlines():
-			if i == "":
-				continue
-			if i.startswith("id name"):
-				found_name = True
-				self.uci_identification.setText("Playing with " + i[8:])
-			elif i.startswith("id author"):
-				found_authors = True
-				self.uci_identification.setText(self.uci_identification.text() + " by " + i[10:])
-		if not (found_name and found_authors):
-			self.uci_identification.setText("")
-		self.uci_process.setText("Engine initialization complete")
+		self.engine = uci.getEnginePool(self.settings_values["engine-pool-size"], self.settings_values["engine-pool-limit"], self.settings_values["engine-idle-timeout"]).acquire(path)
+		self.engine.started.connect(lambda: self.uci_process.setText("Connected to engine, preparing communication with engine..."))
+		self.engine.identified.connect(self.engineIdentified)
+		self.engine.initialized.connect(self.engineInitialized)
+		self.engine.ready.connect(lambda: self.uci_process.setText("Engine initialization complete"))
+		self.engine.bestMove.connect(self.engineBestMove)
+		self.engine.info.connect(self.analysis.addInfo)
+		self.engine.error.connect(lambda error: self.uci_process.setText("Engine error: " + error))
+		if self.engine.uciok:
+			self.engineIdentified(self.engine.name, self.engine.author)
+			self.engineInitialized()
+		if self.game.raw_move_list:
+			self.engine_session = uci.Session(self.engine)
+			game = chess.Game()
+			for i in self.game.raw_move_list:
+				game.move(i.name, evaluate_checks=False, evaluate_move_checks=False, evaluate_move_checkmate=False)
+				self.engine_session.push(game.FEN())
+		else:
+			self.engine_session = uci.Session(self.engine, None if self.game.FEN().split()[:4] == bitboard.starting_fen.split()[:4] else self.game.FEN())
+
+	def engineIdentified(self, name, author):
+		if name and author:
+			self.uci_identification.setText("Playing with " + name + " by " + author)
+
+	def engineInitialized(self):
+		if self.settings_values["engine-ponder"] and "Ponder" in self.engine.options:
+			self.engine.send("setoption name Ponder value true")
+		if "MultiPV" in self.engine.options:
+			self.engine.send("setoption name MultiPV value " + str(self.settings_values["engine-multipv"] if self.settings_values["engine-analysis"] else 1))
+		self.engine.send("isready")
+
+	def engineBestMove(self, move, ponder):
+		if self.discard_engine_moves:
+			self.discard_engine_moves -= 1
+			return
+		self.makeComputerMove(move, ponder)
 
 	def setupBoard(self, position_type, position):
 		if position_type == "FEN":
@@ -474,6 +629,8 @@ class Computer(QWidget):
 			self.game = chess.Game()
 			self.game.loadPGN(position)
 		self.board = board.Board(self, self.game)
+		self.resetOpeningLabels()
+		self.resetPositionKeys()
 		self.sidebar.raise_()
 
 	def addTemporaryMove(self, text):
@@ -493,9 +650,34 @@ class Computer(QWidget):
 				self.clocks[0].pause()
 			if self.clocks[1].running:
 				self.clocks[1].pause()
+		self.cancelSearch()
+		self.stopPondering()
+		self.waitForSearches()
 		self.parent().parent().resetComputerGame()
 		self.parent().setCurrentIndex(0)
 
+	def cleanup(self):
+		# The search threads use the table, the pool, the book and the tablebases, so they are stopped and joined before any of those is closed
+		self.cancelSearch()
+		self.stopPondering()
+		self.waitForSearches()
+		self.statistics.close()
+		if self.engine is not None:
+			uci.getEnginePool().release(self.engine)
+			self.engine = None
+		if self.search_pool is not None:
+			self.search_pool.close()
+			self.search_pool = None
+		if self.transposition_table is not None:
+			self.transposition_table.close()
+			self.transposition_table = None
+		if self.polyglot_book is not None:
+			self.polyglot_book.close()
+			self.polyglot_book = None
+		if self.tablebases is not None:
+			self.tablebases.close()
+			self.tablebases = None
+
 	def getGridIndex(self) -> list:
 		columns = 0
 		for i in range(len(self.move_buttons)):
@@ -509,6 +691,11 @@ class Computer(QWidget):
 		else:
 			self.clocks[1].pause()
 		self.game_over = True
+		if self.engine is not None and self.computer_moving:
+			self.discard_engine_moves += 1
+			self.engine.send("stop")
+		self.cancelSearch()
+		self.stopPondering()
 		self.takeback.deleteLater()
 		self.parent().parent().setWindowTitle("2-Player Chess Game: " + ("Black", "White")[self.clocks.index(clock)] + " wins")
 		self.game_over_label = QLabel("Game Over", self)
@@ -526,6 +713,9 @@ class Computer(QWidget):
 		self.game_result_label.setFixedWidth(self.opening.width())
 
 	def addMove(self, move) -> None:
+		self.position_keys.append(bitboard.Position(self.game.FEN()).key)
+		if self.engine_session is not None:
+			self.engine_session.push(self.game.FEN())
 		if not self.uci_process.isHidden():
 			self.uci_process.hide()
 		self.move_buttons.append(MoveButton(self.moves, move))
@@ -535,6 +725,7 @@ class Computer(QWidget):
 		self.moves_count += 0.5
 		asyncio.get_event_loop().run_until_complete(self.updateOpening())
 		if self.game.game_over:
+			self.stopPondering()
 			self.takeback.deleteLater()
 			self.game_over_label = QLabel("Game Over", self)
 			self.game_over_label.setFont(QFont(QFontDatabase.applicationFontFamilies(QFontDatabase.addApplicationFont(QDir.currentPath() + "/fonts/ChakraPetch-Light.ttf"))[0], 22))
@@ -565,19 +756,10 @@ class Computer(QWidget):
 			self.game_over = True
 			return
 		if self.clocks:
-			if not self.time_control.endswith("+0") and "+" in self.time_control:
-				if self.clocks[1].running:
-					self.clocks[1].clock_seconds += int(self.time_control[self.time_control.index("+") + 1:-1])
-					if self.clocks[1].clock_seconds > 59:
-						self.clocks[1].clock_minutes += 1
-						self.clocks[1].clock_seconds -= 60
-					self.clocks[1].updateText()
-				if self.clocks[0].running:
-					self.clocks[0].clock_seconds += int(self.time_control[self.time_control.index("+") + 1:-1])
-					if self.clocks[0].clock_seconds > 59:
-						self.clocks[0].clock_minutes += 1
-						self.clocks[0].clock_seconds -= 60
-					self.clocks[0].updateText()
+			if self.time_manager.increment:
+				for i in self.clocks:
+					if i.running:
+						i.addTime(self.time_manager.increment)
 			if "+" not in self.time_control:
 				self.clocks[0].resetClock()
 				self.clocks[1].resetClock()
@@ -590,39 +772,67 @@ class Computer(QWidget):
 		if self.game.turn != self.player_color:
 			if self.engine is not None:
 				self.computer_moving = True
-				self.engine.stdin.write("ucinewgame\nposition fen " + self.game.FEN() + "\n")
-				if self.time_control is None:
-					self.engine.stdin.write("go movetime 12000\n")
-				elif "+" in self.time_control:
-					self.engine.stdin.write("go wtime " + str((self.clocks[0].clock_minutes * 60000 + (self.clocks[0].clock_seconds * 1000))) + " btime " + str((self.clocks[1].clock_minutes * 60000 + (self.clocks[1].clock_seconds * 1000))) + " winc " + self.time_control.split("+")[1] + " binc " + self.time_control.split("+")[1] + "\n")
-				else:
-					self.engine.stdin.write("go wtime " + str(int(self.time_control) * 1000) + " btime " + str(int(self.time_control) * 1000) + "\n")
-				self.get_computer_move_thread = QThread()
-				self.get_computer_move_runner = Thread(lambda: chess.functions.toSAN(asyncio.new_event_loop().run_until_complete(self.getEngineMove()).splitlines()[-1].split()[1], self.game))
-				self.get_computer_move_runner.moveToThread(self.get_computer_move_thread)
-				self.get_computer_move_thread.started.connect(self.get_computer_move_runner.run)
-				self.get_computer_move_runner.output.connect(self.makeComputerMove)
-				self.get_computer_move_runner.finished.connect(self.get_computer_move_thread.quit)
-				self.get_computer_move_runner.finished.connect(self.get_computer_move_runner.deleteLater)
-				self.get_computer_move_thread.finished.connect(self.get_computer_move_thread.deleteLater)
-				self.get_computer_move_thread.start()
+				if self.engine_pondering:
+					self.engine_pondering = False
+					if " ".join(self.game.FEN().split()[:3]) == self.ponder_fen:
+						self.engine.send("ponderhit")
+						return
+					self.discard_engine_moves += 1
+					self.engine.send("stop")
+				self.analysis.start(self.game.turn == "white")
+				self.engine_session.go(self.getGoCommand())
 				return
+			if self.ponder_search is not None:
+				search, self.ponder_search = self.ponder_search, None
+				if " ".join(self.game.FEN().split()[:3]) == self.ponder_fen:
+					self.computer_moving = True
+					search.ponderhit(*self.getSearchTime())
+					return
+				search.stop.set()
+			self.analysis.start(self.game.turn == "white")
 			if self.computer_level == 0:
 				computer_move = random.choice(self.game.legal_moves(True))
 				self.board.pieceAt(computer_move.old_position).movePiece(computer_move)
 			else:
 				self.computer_moving = True
-				self.get_computer_move_thread = QThread()
-				self.get_computer_move_runner = Thread(self.getComputerMove)
-				self.get_computer_move_runner.moveToThread(self.get_computer_move_thread)
-				self.get_computer_move_thread.started.connect(self.get_computer_move_runner.run)
-				self.get_computer_move_runner.output.connect(self.makeComputerMove)
-				self.get_computer_move_runner.finished.connect(self.get_computer_move_thread.quit)
-				self.get_computer_move_runner.finished.connect(self.get_computer_move_runner.deleteLater)
-				self.get_computer_move_thread.finished.connect(self.get_computer_move_thread.deleteLater)
-				self.get_computer_move_thread.start()
-
-	def makeComputerMove(self, move):
+				self.search_generation += 1
+				stop = threading.Event()
+				self.startSearchThread(lambda snapshot, stop=stop: self.getComputerMove(snapshot, stop), stop)
+
+	def startSearchThread(self, function, stop):
+		self.search_stop = stop
+		# The game is read here, on the GUI thread, since a takeback can change it while the search runs
+		snapshot = self.searchSnapshot()
+		# Every thread is referenced until it has finished, since a QThread destroyed while running aborts the application
+		thread, runner = QThread(), Thread(lambda: function(snapshot), self.search_generation)
+		runner.moveToThread(thread)
+		thread.started.connect(runner.run)
+		runner.output.connect(self.makeComputerMove)
+		thread.finished.connect(self.searchThreadFinished)
+		self.search_threads.append((thread, runner))
+		thread.start()
+
+	def searchThreadFinished(self):
+		self.search_threads = [x for x in self.search_threads if x[0] is not self.sender()]
+
+	def waitForSearches(self):
+		for thread, _ in self.search_threads:
+			thread.wait()
+		self.search_threads = []
+
+	def cancelSearch(self):
+		# The search stops at its next node check, and anything it still sends carries an old generation and is dropped
+		self.search_generation += 1
+		if self.search_stop is not None:
+			self.search_stop.set()
+			self.search_stop = None
+		self.computer_moving = False
+
+	def makeComputerMove(self, move, ponder="", generation=None):
+		if not move or self.game_over or (generation is not None and generation != self.search_generation):
+			return
+		self.ponder_move = ponder or None
+		move = chess.functions.toSAN(move, self.game)
 		if "+" not in move and "#" not in move:
 			for i in self.game.legal_moves(True):
 				if i.name.replace("+", "").replace("#", "") == move:
@@ -634,46 +844,143 @@ class Computer(QWidget):
 					self.board.pieceAt(i.old_position).movePiece(i)
 					break
 		self.computer_moving = False
+		self.startPondering()
 
-	def getComputerMove(self):
-		if self.game.gamePhase() == "opening":
-			if len(self.game.raw_move_list) <= 4:
-				for i, j in openings.items():
-					if i == self.game.move_list:
-						moves = []
-						weights = []
-						for x, y in j.items():
-							moves.append(x)
-							weights.append(y)
-						return random.choices(population=moves, weights=weights)[0]
-			moves = []
-			for i in chess.openings.openings:
-				if len(i["moves"].split()) != 1 and " ".join(i["moves"].split()[:-1]) == self.game.move_list:
-					moves.append(i["moves"].split()[-1])
-			if moves:
-				return random.choice(moves)
-		return self.game.minimax_evaluation(self.computer_level)
+	def startPondering(self):
+		if not self.settings_values["engine-ponder"] or self.ponder_move is None or self.game_over or self.game.game_over or self.game.turn != self.player_color:
+			return
+		position = bitboard.Position(self.game.FEN())
+		move = position.parseMove(self.ponder_move)
+		if move is None:
+			return
+		position.make(move)
+		self.ponder_fen = " ".join(position.FEN().split()[:3])
+		self.analysis.start(position.turn == bitboard.white)
+		if self.engine is not None:
+			self.engine_pondering = True
+			self.engine_session.go("go ponder " + self.getGoCommand()[3:], self.ponder_move)
+			return
+		position = self.searchPosition(self.searchSnapshot())
+		position.make(position.parseMove(self.ponder_move))
+		ply = len(self.game.raw_move_list) + 1
+		self.ponder_search = engine.Search(position, computer_levels[self.computer_level]["depth"], None, self.transposition_table, threading.Event(), ponder=True, info=lambda info: self.searchInfo(info, ply), tablebases=self.tablebases)
+		self.startSearchThread(lambda snapshot, search=self.ponder_search: self.ponder(search), self.ponder_search.stop)
+
+	def stopPondering(self):
+		if self.ponder_search is not None:
+			self.ponder_search.stop.set()
+			self.ponder_search = None
+		if self.engine_pondering:
+			self.engine_pondering = False
+			self.discard_engine_moves += 1
+			self.engine.send("stop")
+
+	def ponder(self, search):
+		move = search.run()
+		if move is None or search.stop.is_set() or not search.ponder_hit.is_set():
+			return ""
+		return self.searchResult(search, move)
+
+	@staticmethod
+	def searchResult(search, move):
+		variation = search.principalVariation()
+		return {"move": search.position.moveName(move), "ponder": search.position.moveName(variation[1]) if len(variation) > 1 else ""}
+
+	def searchSnapshot(self):
+		# Everything the search thread needs from the game and the clocks
+		return {"fen": self.game.FEN(), "earlier_keys": self.position_keys[:-1], "ply": len(self.game.raw_move_list), "opening": self.game.gamePhase() == "opening", "time": self.getSearchTime()}
+
+	def getComputerMove(self, snapshot, stop=None):
+		# Runs on the search thread, so the game is only read through the snapshot and moves are named on the GUI thread by makeComputerMove
+		if self.polyglot_book is None and os.path.isfile(self.settings_values["opening-book"]):
+			self.polyglot_book = polyglot.PolyglotBook(self.settings_values["opening-book"])
+		if self.polyglot_book is not None:
+			move = self.polyglot_book.choose(snapshot["fen"])
+			if move is not None:
+				return move
+		if snapshot["opening"]:
+			move = book.getOpeningBook(openings, chess.openings.openings).choose(snapshot["fen"])
+			if move is not None:
+				return move
+		# Book lookups and tablebase probes do not watch the stop event, so it is checked between them
+		if stop is not None and stop.is_set():
+			return ""
+		if self.tablebases is None and os.path.isdir(self.settings_values["syzygy-path"]):
+			self.tablebases = syzygy.Tablebases(self.settings_values["syzygy-path"])
+		if self.tablebases is not None:
+			position = bitboard.Position(snapshot["fen"])
+			move = self.tablebases.bestMove(position)
+			if move is not None:
+				return position.moveName(move)
+		if stop is not None and stop.is_set():
+			return ""
+		if self.transposition_table is None:
+			# Weights tuned with tune.py replace the built-in piece-square tables for every level
+			evaluation = self.settings_values["evaluation-weights"] if bitboard.loadEvaluation(self.settings_values["evaluation-weights"]) else None
+			if self.settings_values["engine-parallel-search"]:
+				self.transposition_table = engine.TranspositionTable(self.settings_values["engine-hash-size"], shared=True)
+				self.search_pool = engine.SearchPool(self.settings_values["engine-processes"] or os.cpu_count() or 1, self.transposition_table, evaluation)
+			else:
+				self.transposition_table = engine.TranspositionTable(self.settings_values["engine-hash-size"])
+		time_limit, soft_time_limit = snapshot["time"]
+		info = lambda info: self.searchInfo(info, snapshot["ply"])
+		if self.search_pool is not None:
+			search = self.search_pool.search(self.searchPosition(snapshot), computer_levels[self.computer_level]["depth"], time_limit, info, self.tablebases, soft_time_limit, stop)
+		else:
+			search = engine.Search(self.searchPosition(snapshot), computer_levels[self.computer_level]["depth"], time_limit, self.transposition_table, stop, info=info, tablebases=self.tablebases, soft_time_limit=soft_time_limit)
+			search.run()
+		if stop is not None and stop.is_set():
+			return ""
+		return self.searchResult(search, search.best_move)
+
+	def searchInfo(self, info, ply):
+		self.analysis.info.emit(info)
+		self.statistics.add(info, ply)
+
+	def searchPosition(self, snapshot):
+		# The strongest level evaluates with the network when NumPy and the weights file are available
+		if computer_levels[self.computer_level].get("network"):
+			position = nnue.createPosition(snapshot["fen"], self.settings_values["network-weights"])
+		else:
+			position = bitboard.Position(snapshot["fen"])
+		position.earlier_keys = list(snapshot["earlier_keys"])
+		return position
+
+	def getSearchTime(self):
+		# Hard and soft limits in seconds: the level's own limit, cut down to what the clock allows
+		time_limit = computer_levels[self.computer_level]["time"]
+		if not self.clocks:
+			return time_limit, time_limit / 2
+		clock = self.clocks[0] if self.game.turn == "white" else self.clocks[1]
+		soft, hard = self.time_manager.allocate(clock.remainingTime(), len(self.game.raw_move_list) // 2 + 1)
+		return max(min(time_limit, hard / 1000), 0.01), max(min(time_limit / 2, soft / 1000), 0.01)
 
 	async def updateOpening(self):
-		position = self.game.FEN().split()[0]
-		for i in chess.openings.openings:
-			if i["position"] == position:
-				self.opening.setText(i["eco"] + " " + i["name"])
-				return
+		opening = book.getOpeningNames(chess.openings.openings).lookup(self.game)
+		self.opening_labels.append(opening or self.opening_labels[-1])
+		self.opening.setText(self.opening_labels[-1])
 
 	async def updateTakebackOpening(self):
-		if len(self.game.raw_move_list) >= 20:
-			return
-		game = chess.Game()
-		opening = "Starting Position"
-		for x in self.game.raw_move_list:
-			game.move(x.name, evaluate_checks=False, evaluate_move_checks=False, evaluate_move_checkmate=False)
-			position = game.FEN().split()[0]
-			for y in chess.openings.openings:
-				if y["position"] == position:
-					opening = y["eco"] + " " + y["name"]
-					break
-		self.opening.setText(opening)
+		del self.opening_labels[len(self.game.raw_move_list) + 1:]
+		self.opening.setText(self.opening_labels[-1])
+
+	def resetOpeningLabels(self):
+		# Moves loaded from a PGN are named once here, after that each move pushes a label and each takeback pops one
+		names = book.getOpeningNames(chess.openings.openings)
+		game = type(self.game)()
+		self.opening_labels = ["Starting Position"]
+		for i in self.game.raw_move_list:
+			game.move(i.name, evaluate_checks=False, evaluate_move_checks=False, evaluate_move_checkmate=False)
+			self.opening_labels.append(names.name(game.FEN().split()[0]) or self.opening_labels[-1])
+		self.opening.setText(self.opening_labels[-1])
+
+	def resetPositionKeys(self):
+		# Keys of every position the game has been in, for the search to score repetitions of them as draws
+		game = type(self.game)() if self.game.raw_move_list else self.game
+		self.position_keys = [bitboard.Position(game.FEN()).key]
+		for i in self.game.raw_move_list:
+			game.move(i.name, evaluate_checks=False, evaluate_move_checks=False, evaluate_move_checkmate=False)
+			self.position_keys.append(bitboard.Position(game.FEN()).key)
 
 	def updateSettingsValues(self):
 		self.settings_values = json.load(open("settings.json"))
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+"""
+engine.py
+Built-in Chess Engine
+"""
+
+import time
+import threading
+import multiprocessing
+
+import nnue
+import bitboard
+
+mate_score = 100000
+tablebase_win = mate_score - 2000
+infinity = 1000000
+
+exact, lower_bound, upper_bound = 1, 2, 3
+
+# Selective search features, each of which can be switched off through Search(features=...)
+search_features = {"null-move": True, "late-move-reductions": True, "principal-variation": True, "aspiration": True}
+
+
+class SearchTimeout(Exception):
+	pass
+
+
+class TranspositionTable:
+	"""Fixed-size hash table of search results, stored as two-entry buckets of packed 64-bit words"""
+	def __init__(self, size_mb=16, shared=False, name=None):
+		self.size_mb = size_mb
+		self.buckets = max(size_mb * 1048576 // 32, 1)
+		self.age = 0
+		self.shared_memory = None
+		if shared or name is not None:
+			from multiprocessing import shared_memory
+			self.shared_memory = shared_memory.SharedMemory(name=name, create=name is None, size=self.buckets * 32)
+			self.entries = self.shared_memory.buf[:self.buckets * 32].cast("Q")
+		else:
+			self.entries = memoryview(bytearray(self.buckets * 32)).cast("Q")
+
+	def close(self, unlink=True):
+		if self.shared_memory is not None:
+			self.entries.release()
+			self.shared_memory.close()
+			if unlink:
+				self.shared_memory.unlink()
+			self.shared_memory = None
+
+	def newSearch(self):
+		self.age = (self.age + 1) & 63
+
+	def probe(self, key):
+		index = (key % self.buckets) * 4
+		for slot in (index, index + 2):
+			data = self.entries[slot + 1]
+			if data and self.entries[slot] ^ data == key:
+				score = data >> 32
+				if score >= 2147483648:
+					score -= 4294967296
+				return (data >> 16) & 255, (data >> 24) & 3, score, data & 65535
+		return None
+
+	def store(self, key, depth, flag, score, move):
+		index = (key % self.buckets) * 4
+		replace = replace_value = None
+		for slot in (index, index + 2):
+			data = self.entries[slot + 1]
+			if not data or self.entries[slot] ^ data == key:
+				replace = slot
+				break
+			value = ((data >> 16) & 255) - 4 * ((self.age - ((data >> 26) & 63)) & 63)
+			if replace_value is None or value < replace_value:
+				replace, replace_value = slot, value
+		data = (move & 65535) | (min(depth, 255) << 16) | (flag << 24) | (self.age << 26) | ((score & 4294967295) << 32)
+		self.entries[replace] = key ^ data
+		self.entries[replace + 1] = data
+
+
+def scoreToTable(score, ply):
+	if score >= mate_score - 1000:
+		return score + ply
+	if score <= -mate_score + 1000:
+		return score - ply
+	return score
+
+
+def scoreFromTable(score, ply):
+	if score >= mate_score - 1000:
+		return score - ply
+	if score <= -mate_score + 1000:
+		return score + ply
+	return score
+
+
+class MoveOrdering:
+	"""Orders moves as hash move, captures by MVV-LVA, killer moves, then quiet moves by history score, and counts how often the first move already causes a cutoff"""
+	def __init__(self, max_ply=128):
+		self.killers = [[None, None] for _ in range(max_ply)]
+		self.history = [[0] * 4096 for _ in range(2)]
+		self.cutoffs = self.first_move_cutoffs = 0
+
+	def order(self, position, moves, hash_move, ply):
+		killers = self.killers[min(ply, len(self.killers) - 1)]
+		history = self.history[ply & 1]
+		keys = []
+		for move in moves:
+			encoded = position.encodeMove(move)
+			if encoded == hash_move:
+				keys.append(1 << 40)
+				continue
+			value = position.mvvLva(move)
+			if value is not None:
+				keys.append((1 << 32) + value)
+			elif encoded == killers[0]:
+				keys.append((1 << 31) + 1)
+			elif encoded == killers[1]:
+				keys.append(1 << 31)
+			else:
+				keys.append(history[encoded & 4095])
+		return [x for _, x in sorted(zip(keys, moves), key=lambda x: -x[0])]
+
+	def cutoff(self, position, move, depth, ply, index):
+		self.cutoffs += 1
+		if not index:
+			self.first_move_cutoffs += 1
+		if position.mvvLva(move) is not None:
+			return
+		encoded = position.encodeMove(move)
+		killers = self.killers[min(ply, len(self.killers) - 1)]
+		if killers[0] != encoded:
+			killers[0], killers[1] = encoded, killers[0]
+		history = self.history[ply & 1]
+		history[encoded & 4095] += depth * depth
+		if history[encoded & 4095] >= 1 << 30:
+			for i in range(4096):
+				history[i] //= 2
+
+	def isKiller(self, position, move, ply):
+		return position.encodeMove(move) in self.killers[min(ply, len(self.killers) - 1)]
+
+	def firstMoveCutoffRate(self):
+		return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0
+
+
+class Search:
+	def __init__(self, position, max_depth=64, time_limit=None, table=None, stop=None, start_depth=1, ponder=False, info=None, tablebases=None, features=None, soft_time_limit=None):
+		self.position = position
+		self.features = dict(search_features, **(features or {}))
+		self.info = info
+		self.tablebases = tablebases
+		self.table = table
+		self.stop = stop
+		self.start_depth = start_depth
+		self.max_depth = max_depth
+		self.time_limit = time_limit
+		self.soft_time_limit = soft_time_limit
+		self.ponder = ponder
+		self.ponder_hit = threading.Event()
+		self.deadline = self.soft_deadline = float("inf")
+		self.budget_start = 0
+		self.ordering = MoveOrdering()
+		self.nodes = self.qnodes = 0
+		self.table_probes = self.table_hits = 0
+		self.iteration_nodes = []
+		self.depth = 0
+		self.score = 0
+		self.best_move = None
+
+	def run(self):
+		start = time.monotonic()
+		if self.table is not None:
+			self.table.newSearch()
+		if self.time_limit is not None and not self.ponder:
+			self.setDeadlines(start, self.time_limit, self.soft_time_limit)
+		root_history = len(self.position.history)
+		moves = list(self.position.moves())
+		if not moves:
+			return None
+		self.best_move = moves[0]
+		if len(moves) == 1 and self.time_limit is not None and not self.ponder:
+			return self.best_move
+		stable = 0
+		for depth in range(min(self.start_depth, self.max_depth), self.max_depth + 1):
+			nodes = self.nodes
+			try:
+				score = None
+				# Search a narrow window around the last score first and only widen it when the score falls outside
+				if self.features["aspiration"] and depth >= 4 and abs(self.score) < tablebase_win - 1000:
+					alpha, beta = self.score - 50, self.score + 50
+					score = self.searchRoot(depth, moves, alpha, beta)
+					if score <= alpha or score >= beta:
+						score = None
+				self.score = self.searchRoot(depth, moves) if score is None else score
+			except SearchTimeout:
+				while len(self.position.history) > root_history:
+					self.position.unmake()
+				break
+			stable = stable + 1 if self.best_move == moves[0] else 0
+			self.iteration_nodes.append(self.nodes - nodes)
+			self.depth = depth
+			moves.remove(self.best_move)
+			moves.insert(0, self.best_move)
+			if self.info is not None:
+				self.report(time.monotonic() - start)
+			if abs(self.score) >= mate_score - depth:
+				break
+			# Once the best move has held for a few iterations, the second half of the soft budget is left unused
+			if time.monotonic() >= (self.soft_deadline if stable < 4 else (self.budget_start + self.soft_deadline) / 2):
+				break
+		# A pondering search must not answer before the opponent has moved, even if it has nothing left to search
+		while self.ponder and not self.ponder_hit.wait(0.01) and not (self.stop is not None and self.stop.is_set()):
+			pass
+		return self.best_move
+
+	def report(self, elapsed):
+		if abs(self.score) >= mate_score - 1000:
+			score = ("mate", (mate_score - abs(self.score) + 1) // 2 * (1 if self.score > 0 else -1))
+		else:
+			score = ("cp", self.score)
+		self.info({"depth": self.depth, "score": score, "nodes": self.nodes, "time": int(elapsed * 1000), "nps": int(self.nodes / elapsed) if elapsed else 0, "multipv": 1, "pv": [self.position.moveName(x) for x in self.principalVariation()], "cutoffs": self.ordering.cutoffs, "first_move_cutoffs": self.ordering.first_move_cutoffs, "qnodes": self.qnodes, "tt_probes": self.table_probes, "tt_hits": self.table_hits, "branching": self.branchingFactor()})
+
+	def branchingFactor(self):
+		# Growth of the tree from the previous iteration to the last one
+		if len(self.iteration_nodes) < 2 or not self.iteration_nodes[-2]:
+			return 0.0
+		return round(self.iteration_nodes[-1] / self.iteration_nodes[-2], 2)
+
+	def setDeadlines(self, start, time_limit, soft_time_limit=None):
+		self.budget_start = start
+		self.deadline = start + time_limit
+		self.soft_deadline = start + (time_limit / 2 if soft_time_limit is None else soft_time_limit)
+
+	def ponderhit(self, time_limit=None, soft_time_limit=None):
+		if time_limit is not None:
+			self.setDeadlines(time.monotonic(), time_limit, soft_time_limit)
+		self.ponder_hit.set()
+
+	def principalVariation(self):
+		if self.best_move is None:
+			return []
+		variation = [self.best_move]
+		self.position.make(self.best_move)
+		while self.table is not None and len(variation) < max(self.depth, 1):
+			entry = self.table.probe(self.position.key)
+			if entry is None or not entry[3]:
+				break
+			for move in self.position.moves():
+				if self.position.encodeMove(move) == entry[3]:
+					variation.append(move)
+					self.position.make(move)
+					break
+			else:
+				break
+		for _ in variation:
+			self.position.unmake()
+		return variation
+
+	def searchRoot(self, depth, moves, alpha=-infinity, beta=infinity):
+		for index, move in enumerate(moves):
+			self.position.make(move)
+			if index and self.features["principal-variation"]:
+				score = -self.negamax(depth - 1, -alpha - 1, -alpha, 1)
+				if alpha < score < beta:
+					score = -self.negamax(depth - 1, -beta, -alpha, 1)
+			else:
+				score = -self.negamax(depth - 1, -beta, -alpha, 1)
+			self.position.unmake()
+			if score > alpha:
+				alpha = score
+				self.best_move = move
+				if alpha >= beta:
+					break
+		return alpha
+
+	def negamax(self, depth, alpha, beta, ply, null_move=True):
+		self.nodes += 1
+		if self.nodes % 64 == 0 and (time.monotonic() >= self.deadline or (self.stop is not None and self.stop.is_set())):
+			raise SearchTimeout
+		# Draws are scored before the table is probed, since a stored score does not know the path that led to the position
+		if ply and self.position.isDraw():
+			return 0
+		# Tablebases are probed only after captures and pawn moves, where the piece count can first fall into range
+		if self.tablebases is not None and self.position.halfmove == 0:
+			wdl = self.tablebases.probeWDL(self.position)
+			if wdl is not None:
+				return (tablebase_win - ply) * ((wdl > 1) - (wdl < -1))
+		if depth <= 0:
+			return self.quiescence(alpha, beta, ply)
+		key = hash_move = None
+		if self.table is not None:
+			key = self.position.key
+			entry = self.table.probe(key)
+			self.table_probes += 1
+			if entry is not None:
+				self.table_hits += 1
+				entry_depth, flag, score, hash_move = entry
+				if entry_depth >= depth:
+					score = scoreFromTable(score, ply)
+					if flag == exact or (flag == lower_bound and score >= beta) or (flag == upper_bound and score <= alpha):
+						return score
+		in_check = self.position.inCheck()
+		# If passing still fails high, a real move would too; skipped when in check or with only pawns left, where zugzwang is likely
+		if null_move and self.features["null-move"] and depth >= 3 and not in_check and abs(beta) < tablebase_win - 1000 and self.position.hasPieces(self.position.turn):
+			self.position.makeNull()
+			try:
+				score = -self.negamax(depth - 3 - depth // 6, -beta, -beta + 1, ply + 1, False)
+			finally:
+				self.position.unmake()
+			if score >= beta:
+				return beta
+		moves = self.position.moves()
+		if not moves:
+			return -mate_score + ply if in_check else 0
+		moves = self.ordering.order(self.position, moves, hash_move, ply)
+		original_alpha = alpha
+		best_move = moves[0]
+		for index, move in enumerate(moves):
+			quiet = self.position.mvvLva(move) is None and not self.ordering.isKiller(self.position, move, ply)
+			self.position.make(move)
+			if not index:
+				score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+			else:
+				reduction = 0
+				# Late quiet moves are searched shallower first and only searched fully if they beat alpha
+				if self.features["late-move-reductions"] and index >= 3 and depth >= 3 and quiet and not in_check and not self.position.inCheck():
+					reduction = 2 if index >= 6 else 1
+				if self.features["principal-variation"] or reduction:
+					score = -self.negamax(depth - 1 - reduction, -alpha - 1 if self.features["principal-variation"] else -beta, -alpha, ply + 1)
+					if score > alpha and (reduction or score < beta):
+						score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+				else:
+					score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+			self.position.unmake()
+			if score >= beta:
+				self.ordering.cutoff(self.position, move, depth, ply, index)
+				if key is not None:
+					self.table.store(key, depth, lower_bound, scoreToTable(score, ply), self.position.encodeMove(move))
+				return score
+			if score > alpha:
+				alpha = score
+				best_move = move
+		if key is not None:
+			self.table.store(key, depth, exact if alpha > original_alpha else upper_bound, scoreToTable(alpha, ply), self.position.encodeMove(best_move))
+		return alpha
+
+	def quiescence(self, alpha, beta, ply):
+		"""Search captures and promotions until the position is quiet, so leaves are never scored in the middle of an exchange"""
+		self.nodes += 1
+		self.qnodes += 1
+		if self.nodes % 64 == 0 and (time.monotonic() >= self.deadline or (self.stop is not None and self.stop.is_set())):
+			raise SearchTimeout
+		in_check = self.position.inCheck()
+		if in_check:
+			moves = self.position.moves()
+			if not moves:
+				return -mate_score + ply
+		else:
+			score = self.position.evaluate()
+			if score >= beta:
+				return score
+			alpha = max(alpha, score)
+			moves = []
+			for move in self.position.moves(True):
+				exchange = self.position.see(move)
+				# Captures that lose material cannot raise the score above standing pat
+				if exchange >= 0:
+					moves.append((exchange, move))
+			moves = [x[1] for x in sorted(moves, key=lambda x: -x[0])]
+		for move in moves:
+			self.position.make(move)
+			score = -self.quiescence(-beta, -alpha, ply + 1)
+			self.position.unmake()
+			if score >= beta:
+				return score
+			alpha = max(alpha, score)
+		return alpha
+
+
+worker_table = worker_stop = None
+
+
+def initializeWorker(name, size_mb, stop, evaluation=None):
+	global worker_table, worker_stop
+	if evaluation:
+		bitboard.loadEvaluation(evaluation)
+	worker_table = TranspositionTable(size_mb, name=name)
+	worker_stop = stop
+
+
+def helperSearch(fen, max_depth, time_limit, age, index, weights=None, earlier_keys=()):
+	worker_table.age = age
+	position = nnue.createPosition(fen, weights)
+	position.earlier_keys = list(earlier_keys)
+	search = Search(position, max_depth, time_limit, worker_table, worker_stop, 1 + index % 2)
+	search.run()
+	return search.nodes
+
+
+class SearchPool:
+	"""Lazy SMP: helper processes search the same position and share results through the transposition table"""
+	def __init__(self, processes, table, evaluation=None):
+		context = multiprocessing.get_context("spawn")
+		self.table = table
+		self.stop = context.Event()
+		self.helpers = max(processes - 1, 0)
+		self.pool = context.Pool(self.helpers, initializer=initializeWorker, initargs=(table.shared_memory.name, table.size_mb, self.stop, evaluation)) if self.helpers else None
+
+	def search(self, position, max_depth=64, time_limit=None, info=None, tablebases=None, soft_time_limit=None, stop=None):
+		self.stop.clear()
+		results = []
+		if self.pool is not None:
+			# Helpers evaluate with the same network as the main search, since they share its table
+			weights = position.network.path if isinstance(position, nnue.NetworkPosition) else None
+			earlier_keys = position.earlier_keys + [x[5] for x in position.history]
+			results = [self.pool.apply_async(helperSearch, (position.FEN(), max_depth, time_limit, self.table.age, x, weights, earlier_keys)) for x in range(self.helpers)]
+		search = Search(position, max_depth, time_limit, self.table, stop, info=info, tablebases=tablebases, soft_time_limit=soft_time_limit)
+		search.run()
+		self.stop.set()
+		for i in results:
+			search.nodes += i.get()
+		return search
+
+	def close(self):
+		self.stop.set()
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool = None
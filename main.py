@@ -1191,6 +1191,7 @@ class Window(QMainWindow):
 		self.stacked_pages.insertWidget(1, self.stacks["two-players"])
 
 	def resetComputerGame(self):
+		self.stacks["computer"].cleanup()
 		self.stacks["computer"].deleteLater()
 		self.stacks["computer"] = computer.Computer(self)
 		self.stacked_pages.insertWidget(3, self.stacks["computer"])
@@ -1206,5 +1207,6 @@ class Window(QMainWindow):
 		super(Window, self).resizeEvent(event)
 
 
-application, window = QApplication([]), Window()
-application.exec_()
+if __name__ == "__main__":
+	application, window = QApplication([]), Window()
+	application.exec_()
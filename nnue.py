@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+nnue.py
+Efficiently Updatable Neural Network Evaluation
+"""
+
+import os
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+import bitboard
+
+weights_path = "network.npz"
+
+# The hidden layer is clipped to [0, activation_limit], and output weights are stored multiplied by output_scale
+activation_limit = 255
+output_scale = 64
+max_score = 10000
+
+
+class Network:
+	"""768 piece-square inputs seen from each side, one shared hidden layer and a single output in centipawns
+
+	The weights file is a NumPy .npz archive with feature_weights (768 x hidden, int16), feature_bias (hidden, int16), output_weights (2 x hidden, int16) and output_bias (int32)
+	"""
+	def __init__(self, path):
+		self.path = path
+		with numpy.load(path) as weights:
+			feature_weights = weights["feature_weights"].astype(numpy.int16)
+			self.feature_bias = weights["feature_bias"].astype(numpy.int16)
+			self.output_weights = weights["output_weights"].astype(numpy.int32).reshape(-1)
+			self.output_bias = int(weights["output_bias"])
+		if feature_weights.shape != (768, len(self.feature_bias)) or len(self.output_weights) != 2 * len(self.feature_bias):
+			raise ValueError("network weights in " + path + " have inconsistent shapes")
+		# The rows added to both accumulators when a piece appears on a square; black sees the board mirrored with the colors swapped
+		self.features = numpy.empty((12, 64, 2, len(self.feature_bias)), numpy.int16)
+		for piece in range(12):
+			for square in range(64):
+				self.features[piece, square, bitboard.white] = feature_weights[piece * 64 + square]
+				self.features[piece, square, bitboard.black] = feature_weights[(piece + 6) % 12 * 64 + (square ^ 56)]
+
+	def accumulators(self):
+		return numpy.array([self.feature_bias, self.feature_bias])
+
+	def evaluate(self, accumulators, turn):
+		hidden = numpy.clip(numpy.concatenate((accumulators[turn], accumulators[turn ^ 1])), 0, activation_limit).astype(numpy.int32)
+		score = (int(hidden @ self.output_weights) + self.output_bias) // (activation_limit * output_scale)
+		return max(-max_score, min(max_score, score))
+
+
+class NetworkPosition(bitboard.Position):
+	"""Bitboard position that keeps the network's first layer up to date as pieces are put and removed, so evaluation is only the output layer"""
+	def __init__(self, fen=bitboard.starting_fen, network=None):
+		self.network = network
+		self.accumulators = network.accumulators()
+		super(NetworkPosition, self).__init__(fen)
+
+	def putPiece(self, piece, square):
+		super(NetworkPosition, self).putPiece(piece, square)
+		self.accumulators += self.network.features[piece, square]
+
+	def removePiece(self, piece, square):
+		super(NetworkPosition, self).removePiece(piece, square)
+		self.accumulators -= self.network.features[piece, square]
+
+	def evaluate(self):
+		return self.network.evaluate(self.accumulators, self.turn)
+
+
+networks = {}
+
+
+def getNetwork(path=weights_path):
+	"""The network loaded from path, or None when NumPy is not installed or the file is missing or unreadable"""
+	if numpy is None or not os.path.isfile(path):
+		return None
+	if path not in networks:
+		try:
+			networks[path] = Network(path)
+		except (OSError, KeyError, ValueError):
+			networks[path] = None
+	return networks[path]
+
+
+def createPosition(fen, path=None):
+	network = getNetwork(path) if path else None
+	if network is None:
+		return bitboard.Position(fen)
+	return NetworkPosition(fen, network)
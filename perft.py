@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+perft.py
+Move Generation and Search Benchmark and Correctness Suite
+"""
+
+import sys
+import time
+import argparse
+
+import bitboard
+
+positions = {
+	"startpos": (bitboard.starting_fen, [20, 400, 8902, 197281, 4865609]),
+	"kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+	"position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+	"position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+	"position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+	"position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890, 3894594])
+}
+
+
+class GamePosition:
+	"""Move generation adapter that lets chess.Game run through perft and divide"""
+	def __init__(self, fen):
+		import chess
+		self.game = chess.Game(fen=fen)
+
+	def moves(self):
+		return list(self.game.legal_moves(show_data=True))
+
+	def make(self, move):
+		self.game.move(move)
+
+	def unmake(self):
+		self.game.takeback()
+
+	@staticmethod
+	def moveName(move):
+		return move.name
+
+
+def perft(position, depth):
+	moves = position.moves()
+	if depth == 1:
+		return len(moves)
+	nodes = 0
+	for move in moves:
+		position.make(move)
+		nodes += perft(position, depth - 1)
+		position.unmake()
+	return nodes
+
+
+def divide(position, depth):
+	result = {}
+	for move in position.moves():
+		position.make(move)
+		result[position.moveName(move)] = perft(position, depth - 1) if depth > 1 else 1
+		position.unmake()
+	return result
+
+
+def bench(tests, depth, disabled):
+	# Fixed-depth searches from a fresh table, so node counts compare search features rather than timing
+	import engine
+	features = {x: False for x in disabled}
+	total_nodes = total_time = 0
+	for name, (fen, _) in tests.items():
+		search = engine.Search(bitboard.Position(fen), max_depth=depth, table=engine.TranspositionTable(16), features=features)
+		start = time.perf_counter()
+		move = search.run()
+		elapsed = time.perf_counter() - start
+		total_nodes += search.nodes
+		total_time += elapsed
+		print(name.ljust(10), "depth", depth, str(search.nodes).rjust(10), "nodes", ("%.2f" % elapsed).rjust(7), "s", str(int(search.nodes / elapsed) if elapsed else 0).rjust(7), "nps", ("%.1f%%" % (search.ordering.firstMoveCutoffRate() * 100)).rjust(6), "first move cutoffs", "best", search.position.moveName(move) if move is not None else "-", "score", search.score)
+	print("total".ljust(10), "depth", depth, str(total_nodes).rjust(10), "nodes", ("%.2f" % total_time).rjust(7), "s", str(int(total_nodes / total_time) if total_time else 0).rjust(7), "nps")
+
+
+def getGenerators(name):
+	generators = {}
+	if name in ("bitboard", "both"):
+		generators["bitboard"] = bitboard.Position
+	if name in ("game", "both"):
+		generators["game"] = GamePosition
+	return generators
+
+
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description="Count move generation leaf nodes on standard test positions")
+	parser.add_argument("--depth", type=int, default=3, help="maximum depth to search from each position")
+	parser.add_argument("--generator", choices=["bitboard", "game", "both"], default="bitboard", help="move generator to measure")
+	parser.add_argument("--position", action="append", choices=list(positions), help="test position to run (default: all)")
+	parser.add_argument("--fen", help="run a single custom position instead of the test positions")
+	parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+	parser.add_argument("--bench", action="store_true", help="run fixed-depth searches to --depth instead of counting leaf nodes")
+	parser.add_argument("--disable", action="append", default=[], choices=["null-move", "late-move-reductions", "principal-variation", "aspiration"], help="search feature to switch off in --bench mode")
+	arguments = parser.parse_args(arguments)
+	if arguments.fen:
+		tests = {"custom": (arguments.fen, [])}
+	else:
+		tests = {x: positions[x] for x in (arguments.position or positions)}
+	if arguments.bench:
+		bench(tests, arguments.depth, arguments.disable)
+		return 0
+	failed = False
+	for generator_name, generator in getGenerators(arguments.generator).items():
+		for name, (fen, expected) in tests.items():
+			for depth in range(1, arguments.depth + 1):
+				if expected and depth > len(expected):
+					break
+				position = generator(fen)
+				start = time.perf_counter()
+				if arguments.divide:
+					counts = divide(position, depth)
+					nodes = sum(counts.values())
+				else:
+					nodes = perft(position, depth)
+				elapsed = time.perf_counter() - start
+				status = ""
+				if expected:
+					status = "ok" if nodes == expected[depth - 1] else "FAILED (expected " + str(expected[depth - 1]) + ")"
+					failed = failed or nodes != expected[depth - 1]
+				print(generator_name.ljust(9), name.ljust(10), "depth", depth, str(nodes).rjust(10), "nodes", str(int(nodes / elapsed) if elapsed else 0).rjust(9), "nps", status)
+				if arguments.divide:
+					for x, y in sorted(counts.items()):
+						print("    " + x + ": " + str(y))
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -12,7 +12,7 @@ from PyQt5.QtWidgets import *
 
 import json
 
-settings_defaults = {"light-square-color": "#FFFFDD", "dark-square-color": "#86A666", "piece-animation-speed": "Default"}
+settings_defaults = {"light-square-color": "#FFFFDD", "dark-square-color": "#86A666", "piece-animation-speed": "Default", "engine-hash-size": 16, "engine-parallel-search": False, "engine-processes": 0, "engine-ponder": False, "engine-pool-size": 1, "engine-pool-limit": 4, "engine-idle-timeout": 300, "engine-analysis": True, "engine-multipv": 3, "engine-move-time": 12, "engine-statistics": False, "search-log-directory": "", "opening-book": "", "syzygy-path": "", "network-weights": "network.npz", "evaluation-weights": "evaluation.json"}
 
 try:
 	settings = json.load(open("settings.json"))
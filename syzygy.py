@@ -0,0 +1,567 @@
+# -*- coding: utf-8 -*-
+
+"""
+syzygy.py
+Syzygy Endgame Tablebase Probing
+"""
+
+import os
+import mmap
+import struct
+
+import bitboard
+
+loss, blessed_loss, draw, cursed_win, win = -2, -1, 0, 1, 2
+
+wdl_magic = b"\x71\xe8\x23\x5d"
+dtz_magic = b"\xd7\x66\x0c\xa5"
+
+stm_flag, mapped_flag, win_plies_flag, loss_plies_flag, wide_flag, single_value_flag = 1, 2, 4, 8, 16, 128
+
+piece_order = "KQRBNP"
+dtz_wdl_map = [1, 3, 0, 2, 0]
+mask64 = 0xFFFFFFFFFFFFFFFF
+
+
+class TablebaseError(Exception):
+	pass
+
+
+def offDiagonal(square):
+	return (square >> 3) - (square & 7)
+
+
+binomial = [[0] * 64 for _ in range(7)]
+binomial[0][0] = 1
+for _n in range(1, 64):
+	for _k in range(min(6, _n) + 1):
+		binomial[_k][_n] = (binomial[_k - 1][_n - 1] if _k else 0) + (binomial[_k][_n - 1] if _k < _n else 0)
+
+# Squares below the a1-h8 diagonal, numbered 0 to 27
+map_b1h1h7 = [0] * 64
+_code = 0
+for _square in range(64):
+	if offDiagonal(_square) < 0:
+		map_b1h1h7[_square] = _code
+		_code += 1
+
+# The a1-d1-d4 triangle numbered 0 to 9, with the diagonal squares last
+map_a1d1d4 = [0] * 64
+_code = 0
+_diagonal = []
+for _square in range(28):
+	if offDiagonal(_square) < 0 and _square & 7 <= 3:
+		map_a1d1d4[_square] = _code
+		_code += 1
+	elif not offDiagonal(_square) and _square & 7 <= 3:
+		_diagonal.append(_square)
+for _square in _diagonal:
+	map_a1d1d4[_square] = _code
+	_code += 1
+
+# The 462 legal placements of two kings with the first king in the a1-d1-d4 triangle
+map_kk = [[0] * 64 for _ in range(10)]
+_code = 0
+_both_on_diagonal = []
+for _index in range(10):
+	for _first in range(28):
+		if map_a1d1d4[_first] != _index or (not _index and _first != 1):
+			continue
+		for _second in range(64):
+			if (bitboard.king_attacks[_first] | (1 << _first)) >> _second & 1:
+				continue
+			if not offDiagonal(_first) and offDiagonal(_second) > 0:
+				continue
+			if not offDiagonal(_first) and not offDiagonal(_second):
+				_both_on_diagonal.append((_index, _second))
+			else:
+				map_kk[_index][_second] = _code
+				_code += 1
+for _index, _second in _both_on_diagonal:
+	map_kk[_index][_second] = _code
+	_code += 1
+
+# Pawn squares numbered so that the leading pawn, nearest the edge and lowest on its file, has the highest number
+map_pawns = [0] * 64
+lead_pawn_index = [[0] * 64 for _ in range(7)]
+lead_pawns_size = [[0] * 4 for _ in range(7)]
+_available = 47
+for _count in range(1, 7):
+	for _file in range(4):
+		_index = 0
+		for _rank in range(1, 7):
+			_square = _rank * 8 + _file
+			if _count == 1:
+				map_pawns[_square] = _available
+				map_pawns[_square ^ 7] = _available - 1
+				_available -= 2
+			lead_pawn_index[_count][_square] = _index
+			_index += binomial[_count - 1][map_pawns[_square]]
+		lead_pawns_size[_count][_file] = _index
+
+
+def materialName(position, color):
+	name = ""
+	for i in piece_order:
+		name += i * bitboard.popCount(position.bitboards["PNBRQK".index(i) + 6 * color])
+	return name
+
+
+def pieceCode(piece):
+	return piece % 6 + 1 + 8 * (piece // 6)
+
+
+def isZeroing(position, move):
+	return position.board[(move >> 6) & 63] >= 0 or move >> 15 == bitboard.en_passant_flag or position.board[move & 63] % 6 == bitboard.pawn
+
+
+def isCapture(position, move):
+	return position.board[(move >> 6) & 63] >= 0 or move >> 15 == bitboard.en_passant_flag
+
+
+def sign(value):
+	return (value > 0) - (value < 0)
+
+
+def dtzBeforeZeroing(wdl):
+	return {win: 1, cursed_win: 101, draw: 0, blessed_loss: -101, loss: -1}[wdl]
+
+
+class PairsData:
+	def __init__(self):
+		self.flags = 0
+		self.pieces = []
+		self.group_length = []
+		self.group_index = []
+		self.map_index = []
+
+
+class Table:
+	"""One WDL or DTZ file, memory-mapped and set up on its first probe"""
+	def __init__(self, path, name, dtz):
+		self.path = path
+		self.dtz = dtz
+		self.white, self.black = name.split("v")
+		self.symmetric = self.white == self.black
+		self.piece_count = len(self.white) + len(self.black)
+		self.has_pawns = "P" in name
+		white_pawns, black_pawns = self.white.count("P"), self.black.count("P")
+		# The side with fewer pawns leads, as long as it has any
+		if not black_pawns or (white_pawns and black_pawns >= white_pawns):
+			self.pawn_count = [white_pawns, black_pawns]
+		else:
+			self.pawn_count = [black_pawns, white_pawns]
+		self.unique_pieces = any((x.count(y) == 1) for x in (self.white, self.black) for y in "QRBNP")
+		self.file = self.data = None
+
+	def open(self):
+		if self.data is not None:
+			return
+		self.file = open(self.path, "rb")
+		self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		if self.data[:4] != (dtz_magic if self.dtz else wdl_magic):
+			self.close()
+			raise TablebaseError("invalid magic header in " + self.path)
+		self.setup()
+
+	def close(self):
+		if self.data is not None:
+			self.data.close()
+			self.file.close()
+		self.file = self.data = None
+
+	def setup(self):
+		data = self.data
+		sides = 1 if self.dtz or self.symmetric else 2
+		files = 4 if self.has_pawns else 1
+		both_pawns = self.has_pawns and self.pawn_count[1] > 0
+		self.pairs = [[PairsData() for _ in range(files)] for _ in range(sides)]
+		offset = 5
+		for file in range(files):
+			order = [[data[offset] & 15, data[offset + 1] & 15 if both_pawns else 15], [data[offset] >> 4, data[offset + 1] >> 4 if both_pawns else 15]]
+			offset += 1 + both_pawns
+			for i in range(sides):
+				self.pairs[i][file].pieces = [data[offset + x] >> 4 if i else data[offset + x] & 15 for x in range(self.piece_count)]
+			offset += self.piece_count
+			for i in range(sides):
+				self.setGroups(self.pairs[i][file], order[i], file)
+		offset += offset & 1
+		for file in range(files):
+			for i in range(sides):
+				offset = self.setSizes(self.pairs[i][file], offset)
+		if self.dtz:
+			offset = self.setMap(offset, files)
+		for file in range(files):
+			for i in range(sides):
+				self.pairs[i][file].sparse_index = offset
+				offset += self.pairs[i][file].sparse_index_size * 6
+		for file in range(files):
+			for i in range(sides):
+				self.pairs[i][file].block_lengths = offset
+				offset += self.pairs[i][file].block_length_size * 2
+		for file in range(files):
+			for i in range(sides):
+				offset = (offset + 63) & ~63
+				self.pairs[i][file].blocks_offset = offset
+				offset += self.pairs[i][file].blocks * self.pairs[i][file].block_size
+
+	def setGroups(self, pairs, order, file):
+		first_length = 0 if self.has_pawns else 3 if self.unique_pieces else 2
+		pairs.group_length = [1]
+		for i in range(1, self.piece_count):
+			first_length -= 1
+			if first_length > 0 or pairs.pieces[i] == pairs.pieces[i - 1]:
+				pairs.group_length[-1] += 1
+			else:
+				pairs.group_length.append(1)
+		groups = len(pairs.group_length)
+		pairs.group_length.append(0)
+		pairs.group_index = [0] * (groups + 1)
+		both_pawns = self.has_pawns and self.pawn_count[1] > 0
+		next_group = 2 if both_pawns else 1
+		free_squares = 64 - pairs.group_length[0] - (pairs.group_length[1] if both_pawns else 0)
+		index = 1
+		k = 0
+		while next_group < groups or k == order[0] or k == order[1]:
+			if k == order[0]:
+				pairs.group_index[0] = index
+				index *= lead_pawns_size[pairs.group_length[0]][file] if self.has_pawns else 31332 if self.unique_pieces else 462
+			elif k == order[1]:
+				pairs.group_index[1] = index
+				index *= binomial[pairs.group_length[1]][48 - pairs.group_length[0]]
+			else:
+				pairs.group_index[next_group] = index
+				index *= binomial[pairs.group_length[next_group]][free_squares]
+				free_squares -= pairs.group_length[next_group]
+				next_group += 1
+			k += 1
+		pairs.group_index[groups] = index
+
+	def setSizes(self, pairs, offset):
+		data = self.data
+		pairs.flags = data[offset]
+		if pairs.flags & single_value_flag:
+			pairs.blocks = pairs.block_length_size = pairs.span = pairs.sparse_index_size = pairs.block_size = 0
+			pairs.min_symbol_length = data[offset + 1]
+			return offset + 2
+		size = pairs.group_index[pairs.group_length.index(0)]
+		pairs.block_size = 1 << data[offset + 1]
+		pairs.span = 1 << data[offset + 2]
+		pairs.sparse_index_size = (size + pairs.span - 1) // pairs.span
+		padding = data[offset + 3]
+		pairs.blocks = struct.unpack_from("<I", data, offset + 4)[0]
+		pairs.block_length_size = pairs.blocks + padding
+		max_symbol_length = data[offset + 8]
+		pairs.min_symbol_length = data[offset + 9]
+		offset += 10
+		lengths = max_symbol_length - pairs.min_symbol_length + 1
+		pairs.lowest_symbol = struct.unpack_from("<" + str(lengths) + "H", data, offset)
+		# Canonical Huffman codes: base[i] is the smallest code of length min_symbol_length + i, padded to 64 bits
+		pairs.base = [0] * lengths
+		for i in range(lengths - 2, -1, -1):
+			pairs.base[i] = (pairs.base[i + 1] + pairs.lowest_symbol[i] - pairs.lowest_symbol[i + 1]) // 2
+		for i in range(lengths):
+			pairs.base[i] = (pairs.base[i] << (64 - i - pairs.min_symbol_length)) & mask64
+		offset += lengths * 2
+		symbols = struct.unpack_from("<H", data, offset)[0]
+		offset += 2
+		pairs.left, pairs.right = [], []
+		for i in range(symbols):
+			a, b, c = data[offset + 3 * i:offset + 3 * i + 3]
+			pairs.left.append(((b & 15) << 8) | a)
+			pairs.right.append((c << 4) | (b >> 4))
+		# Each symbol stands for a pair of symbols, symbol_length is the number of values it expands to minus one
+		pairs.symbol_length = [None] * symbols
+		for i in range(symbols):
+			stack = [i]
+			while stack:
+				symbol = stack[-1]
+				if pairs.symbol_length[symbol] is not None:
+					stack.pop()
+				elif pairs.right[symbol] == 0xFFF:
+					pairs.symbol_length[symbol] = 0
+					stack.pop()
+				else:
+					children = [x for x in (pairs.left[symbol], pairs.right[symbol]) if pairs.symbol_length[x] is None]
+					if children:
+						stack.extend(children)
+					else:
+						pairs.symbol_length[symbol] = pairs.symbol_length[pairs.left[symbol]] + pairs.symbol_length[pairs.right[symbol]] + 1
+						stack.pop()
+		return offset + symbols * 3 + (symbols & 1)
+
+	def setMap(self, offset, files):
+		self.map = offset
+		for file in range(files):
+			pairs = self.pairs[0][file]
+			if not pairs.flags & mapped_flag:
+				continue
+			if pairs.flags & wide_flag:
+				offset += offset & 1
+				for _ in range(4):
+					pairs.map_index.append((offset - self.map) // 2 + 1)
+					offset += 2 * struct.unpack_from("<H", self.data, offset)[0] + 2
+			else:
+				for _ in range(4):
+					pairs.map_index.append(offset - self.map + 1)
+					offset += self.data[offset] + 1
+		return offset + (offset & 1)
+
+	def blockLength(self, pairs, block):
+		return struct.unpack_from("<H", self.data, pairs.block_lengths + 2 * block)[0]
+
+	def decompress(self, pairs, index):
+		if pairs.flags & single_value_flag:
+			return pairs.min_symbol_length
+		data = self.data
+		block, offset = struct.unpack_from("<IH", data, pairs.sparse_index + 6 * (index // pairs.span))
+		offset += index % pairs.span - pairs.span // 2
+		while offset < 0:
+			block -= 1
+			offset += self.blockLength(pairs, block) + 1
+		while offset > self.blockLength(pairs, block):
+			offset -= self.blockLength(pairs, block) + 1
+			block += 1
+		pointer = pairs.blocks_offset + block * pairs.block_size
+		buffer = struct.unpack_from(">Q", data, pointer)[0]
+		pointer += 8
+		buffer_size = 64
+		while True:
+			length = 0
+			while buffer < pairs.base[length]:
+				length += 1
+			symbol = (((buffer - pairs.base[length]) >> (64 - length - pairs.min_symbol_length)) + pairs.lowest_symbol[length]) & 0xFFFF
+			if offset < pairs.symbol_length[symbol] + 1:
+				break
+			offset -= pairs.symbol_length[symbol] + 1
+			length += pairs.min_symbol_length
+			buffer = (buffer << length) & mask64
+			buffer_size -= length
+			if buffer_size <= 32:
+				buffer_size += 32
+				buffer |= struct.unpack_from(">I", data, pointer)[0] << (64 - buffer_size)
+				pointer += 4
+		while pairs.symbol_length[symbol]:
+			left = pairs.left[symbol]
+			if offset < pairs.symbol_length[left] + 1:
+				symbol = left
+			else:
+				offset -= pairs.symbol_length[left] + 1
+				symbol = pairs.right[symbol]
+		return pairs.left[symbol]
+
+	def probe(self, position, wdl=draw):
+		"""Raw table value for the position, or None when a DTZ table only stores the other side to move"""
+		self.open()
+		flip = (self.symmetric and position.turn == bitboard.black) or materialName(position, bitboard.white) != self.white
+		color_flip, square_flip = 8 * flip, 56 * flip
+		side = flip ^ position.turn
+		squares, pieces = [], []
+		lead_pawns = 0
+		file = 0
+		if self.has_pawns:
+			lead_piece = self.pairs[0][0].pieces[0] ^ color_flip
+			lead_pawns = position.bitboards[bitboard.pawn + 6 * (lead_piece >> 3)]
+			squares = [x ^ square_flip for x in bitboard.squares(lead_pawns)]
+			pieces = [lead_piece] * len(squares)
+			leading = max(range(len(squares)), key=lambda x: map_pawns[squares[x]])
+			squares[0], squares[leading] = squares[leading], squares[0]
+			file = min(squares[0] & 7, 7 - (squares[0] & 7))
+		lead_count = len(squares)
+		if self.dtz and (self.pairs[0][file].flags & stm_flag) != side and not (self.symmetric and not self.has_pawns):
+			return None
+		for i in bitboard.squares((position.occupancy[0] | position.occupancy[1]) & ~lead_pawns):
+			squares.append(i ^ square_flip)
+			pieces.append(pieceCode(position.board[i]) ^ color_flip)
+		pairs = self.pairs[side if len(self.pairs) > 1 else 0][file]
+		size = len(squares)
+		# Put the pieces in the order the table was encoded with
+		for i in range(lead_count, size - 1):
+			for j in range(i + 1, size):
+				if pairs.pieces[i] == pieces[j]:
+					pieces[i], pieces[j] = pieces[j], pieces[i]
+					squares[i], squares[j] = squares[j], squares[i]
+					break
+		if squares[0] & 7 > 3:
+			squares = [x ^ 7 for x in squares]
+		if self.has_pawns:
+			index = lead_pawn_index[lead_count][squares[0]]
+			squares[1:lead_count] = sorted(squares[1:lead_count], key=lambda x: map_pawns[x])
+			for i in range(1, lead_count):
+				index += binomial[i][map_pawns[squares[i]]]
+		else:
+			if squares[0] >> 3 > 3:
+				squares = [x ^ 56 for x in squares]
+			for i in range(pairs.group_length[0]):
+				if not offDiagonal(squares[i]):
+					continue
+				if offDiagonal(squares[i]) > 0:
+					squares[i:] = [((x >> 3) | (x << 3)) & 63 for x in squares[i:]]
+				break
+			if self.unique_pieces:
+				adjust1 = squares[1] > squares[0]
+				adjust2 = (squares[2] > squares[0]) + (squares[2] > squares[1])
+				if offDiagonal(squares[0]):
+					index = (map_a1d1d4[squares[0]] * 63 + (squares[1] - adjust1)) * 62 + squares[2] - adjust2
+				elif offDiagonal(squares[1]):
+					index = (6 * 63 + (squares[0] >> 3) * 28 + map_b1h1h7[squares[1]]) * 62 + squares[2] - adjust2
+				elif offDiagonal(squares[2]):
+					index = 6 * 63 * 62 + 4 * 28 * 62 + (squares[0] >> 3) * 7 * 28 + ((squares[1] >> 3) - adjust1) * 28 + map_b1h1h7[squares[2]]
+				else:
+					index = 6 * 63 * 62 + 4 * 28 * 62 + 4 * 7 * 28 + (squares[0] >> 3) * 7 * 6 + ((squares[1] >> 3) - adjust1) * 6 + (squares[2] >> 3) - adjust2
+			else:
+				index = map_kk[map_a1d1d4[squares[0]]][squares[1]]
+		index *= pairs.group_index[0]
+		start = pairs.group_length[0]
+		remaining_pawns = self.has_pawns and self.pawn_count[1] > 0
+		group = 1
+		while pairs.group_length[group]:
+			end = start + pairs.group_length[group]
+			squares[start:end] = sorted(squares[start:end])
+			value = 0
+			for i in range(start, end):
+				adjust = sum(1 for x in squares[:start] if squares[i] > x)
+				value += binomial[i - start + 1][squares[i] - adjust - 8 * remaining_pawns]
+			remaining_pawns = False
+			index += value * pairs.group_index[group]
+			start = end
+			group += 1
+		value = self.decompress(pairs, index)
+		if not self.dtz:
+			return value - 2
+		pairs = self.pairs[0][file]
+		if pairs.flags & mapped_flag:
+			position_in_map = pairs.map_index[dtz_wdl_map[wdl + 2]] + value
+			if pairs.flags & wide_flag:
+				value = struct.unpack_from("<H", self.data, self.map + 2 * position_in_map)[0]
+			else:
+				value = self.data[self.map + position_in_map]
+		if (wdl == win and not pairs.flags & win_plies_flag) or (wdl == loss and not pairs.flags & loss_plies_flag) or wdl in (cursed_win, blessed_loss):
+			value *= 2
+		return value + 1
+
+
+class Tablebases:
+	"""Syzygy WDL and DTZ tables found in a directory"""
+	def __init__(self, directory):
+		self.wdl_tables, self.dtz_tables = {}, {}
+		self.max_pieces = 0
+		for i in os.listdir(directory):
+			name, extension = os.path.splitext(i)
+			if extension not in (".rtbw", ".rtbz") or name.count("v") != 1 or not all(x in piece_order for x in name.replace("v", "")):
+				continue
+			(self.dtz_tables if extension == ".rtbz" else self.wdl_tables)[name] = Table(os.path.join(directory, i), name, extension == ".rtbz")
+			self.max_pieces = max(self.max_pieces, len(name) - 1)
+
+	def close(self):
+		for i in list(self.wdl_tables.values()) + list(self.dtz_tables.values()):
+			i.close()
+
+	def probeTable(self, tables, position, wdl=draw):
+		white, black = materialName(position, bitboard.white), materialName(position, bitboard.black)
+		if white == black == "K":
+			return draw
+		table = tables.get(white + "v" + black) or tables.get(black + "v" + white)
+		if table is None:
+			raise TablebaseError("missing table for " + white + "v" + black)
+		return table.probe(position, wdl)
+
+	def searchWDL(self, position, zeroing_moves=False):
+		# Tables store arbitrary values where a capture is best, so captures (and pawn moves for DTZ) are searched first
+		moves = position.moves()
+		best = loss
+		searched = 0
+		for move in moves:
+			if not (isZeroing(position, move) if zeroing_moves else isCapture(position, move)):
+				continue
+			searched += 1
+			position.make(move)
+			try:
+				value = -self.searchWDL(position)[0]
+			finally:
+				position.unmake()
+			if value > best:
+				best = value
+				if value >= win:
+					return value, True
+		no_more_moves = searched and searched == len(moves)
+		value = best if no_more_moves else self.probeTable(self.wdl_tables, position)
+		if best >= value:
+			return best, best > draw or no_more_moves
+		return value, False
+
+	def dtz(self, position):
+		wdl, zeroing = self.searchWDL(position, True)
+		if wdl == draw:
+			return 0
+		if zeroing:
+			return dtzBeforeZeroing(wdl)
+		value = self.probeTable(self.dtz_tables, position, wdl)
+		if value is not None:
+			return (value + 100 * (wdl in (blessed_loss, cursed_win))) * sign(wdl)
+		# The table only stores the other side to move, so look one move ahead
+		best = 0xFFFF
+		for move in position.moves():
+			zeroing = isZeroing(position, move)
+			position.make(move)
+			try:
+				value = -dtzBeforeZeroing(self.searchWDL(position)[0]) if zeroing else -self.dtz(position)
+				if value == 1 and position.inCheck() and not position.moves():
+					best = 1
+			finally:
+				position.unmake()
+			if not zeroing:
+				value += sign(value)
+			if value < best and sign(value) == sign(wdl):
+				best = value
+		return -1 if best == 0xFFFF else best
+
+	def canProbe(self, position):
+		return not position.castling and bitboard.popCount(position.occupancy[0] | position.occupancy[1]) <= self.max_pieces
+
+	def probeWDL(self, position):
+		if not self.canProbe(position):
+			return None
+		try:
+			return self.searchWDL(position)[0]
+		except TablebaseError:
+			return None
+
+	def probeDTZ(self, position):
+		if not self.canProbe(position):
+			return None
+		try:
+			return self.dtz(position)
+		except TablebaseError:
+			return None
+
+	def bestMove(self, position):
+		"""The move that keeps the best result, reaching the next capture or pawn move soonest when winning"""
+		if not self.canProbe(position):
+			return None
+		best = best_rank = None
+		try:
+			for move in position.moves():
+				zeroing = isZeroing(position, move)
+				position.make(move)
+				try:
+					if zeroing:
+						dtz = dtzBeforeZeroing(-self.searchWDL(position)[0])
+					else:
+						dtz = -self.dtz(position)
+						dtz += sign(dtz)
+					if dtz == 2 and position.inCheck() and not position.moves():
+						dtz = 1
+				finally:
+					position.unmake()
+				if dtz > 0:
+					rank = (3 if dtz + position.halfmove <= 100 else 2, -dtz)
+				elif dtz < 0:
+					rank = (0, -dtz)
+				else:
+					rank = (1, 0)
+				if best_rank is None or rank > best_rank:
+					best, best_rank = move, rank
+		except TablebaseError:
+			return None
+		return best
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+timemanager.py
+Move Time Allocation
+"""
+
+# Time kept back on every move for the interface, thread start-up and engine communication, in milliseconds
+move_overhead = 100
+# Moves the remaining time is spread over, falling as the game goes on but never below the minimum
+moves_to_go, minimum_moves_to_go = 40, 20
+
+
+def parseTimeControl(text):
+	"""Base time, increment and time per move in milliseconds for time controls such as "10.0m+0s", "2.5m+3s" and "30s", or None for unlimited games"""
+	if text is None or text == "unlimited":
+		return None
+	if "+" in text:
+		base, increment = text.split("+")
+		return round(float(base.rstrip("m")) * 60000), round(float(increment.rstrip("s")) * 1000), None
+	return None, 0, round(float(text.rstrip("s")) * 1000)
+
+
+class TimeManager:
+	"""Soft and hard move deadlines from the time control and the time left on the clock
+
+	The search stops starting new iterations after the soft deadline and aborts at the hard one
+	"""
+	def __init__(self, time_control=None, unlimited_move_time=12000):
+		parsed = parseTimeControl(time_control)
+		self.unlimited = parsed is None
+		self.base, self.increment, self.move_time = parsed or (None, 0, unlimited_move_time)
+
+	def allocate(self, remaining=None, move_number=1):
+		if self.move_time is not None:
+			limit = max(self.move_time - move_overhead, move_overhead)
+			return limit, limit
+		available = max(remaining - move_overhead, 0)
+		soft = available / max(moves_to_go - move_number, minimum_moves_to_go) + self.increment * 3 / 4
+		# The increment only arrives after the move, so a deadline never comes close to using up the clock
+		hard = min(soft * 4, available / 2)
+		return min(soft, hard), hard
+
+	def goCommand(self, white_remaining=None, black_remaining=None):
+		if self.move_time is not None:
+			return "go movetime " + str(max(self.move_time - move_overhead, move_overhead))
+		return "go wtime " + str(int(white_remaining)) + " btime " + str(int(black_remaining)) + " winc " + str(self.increment) + " binc " + str(self.increment)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+tune.py
+Texel Tuning of the Piece-Square Evaluation
+"""
+
+import re
+import sys
+import json
+import time
+import argparse
+
+import numpy
+
+import book
+import bitboard
+
+results = {"1-0": 1.0, "1/2-1/2": 0.5, "0-1": 0.0}
+comment = re.compile(r"\{[^}]*\}|;[^\n]*")
+variation = re.compile(r"\([^()]*\)")
+annotation = re.compile(r"\$\d+")
+result_tag = re.compile(r'\[Result\s+"([^"]*)"\]')
+mirror = numpy.arange(64) ^ 56
+
+
+def readGames(path):
+	"""Yields the result and move text of each game in a PGN file"""
+	with open(path, errors="replace") as file:
+		text = file.read()
+	for game in re.split(r"\n\s*\n(?=\[)", text):
+		result = result_tag.search(game)
+		if result is None or result.group(1) not in results:
+			continue
+		moves = "\n".join(x for x in game.splitlines() if not x.startswith("["))
+		moves = comment.sub(" ", moves)
+		# Variations can nest, so innermost ones are removed first until none are left
+		while True:
+			stripped = variation.sub(" ", moves)
+			if stripped == moves:
+				break
+			moves = stripped
+		moves = annotation.sub(" ", moves)
+		yield results[result.group(1)], [x for x in book.parseMoveList(moves) if x not in results and x != "*"]
+
+
+def isQuiet(position):
+	if position.inCheck():
+		return False
+	return all(position.see(x) <= 0 for x in position.moves(noisy=True))
+
+
+def extractPositions(paths, skip_plies=8, limit=None):
+	"""Boards of the quiet positions in the games, as rows of piece indices with -1 for empty squares, and the result of each game from white's side"""
+	boards, outcomes = [], []
+	for path in paths:
+		for result, moves in readGames(path):
+			position = bitboard.Position()
+			for ply, name in enumerate(moves):
+				move = position.parseSAN(name)
+				if move is None:
+					break
+				position.make(move)
+				if ply + 1 >= skip_plies and isQuiet(position):
+					boards.append(list(position.board))
+					outcomes.append(result)
+			if limit is not None and len(boards) >= limit:
+				return numpy.array(boards[:limit], numpy.int8), numpy.array(outcomes[:limit], numpy.float32)
+	return numpy.array(boards, numpy.int8).reshape(-1, 64), numpy.array(outcomes, numpy.float32)
+
+
+def buildFeatures(boards):
+	"""Piece counts per piece type and diagram square of the tables, white pieces +1 and black pieces -1 on the mirrored board, and the middlegame share of each position"""
+	features = numpy.empty((len(boards), 384), numpy.int8)
+	for piece in range(6):
+		features[:, piece * 64:(piece + 1) * 64] = (boards[:, mirror] == piece).astype(numpy.int8) - (boards == piece + 6)
+	phase = numpy.zeros(len(boards), numpy.float32)
+	for piece in range(12):
+		phase += (boards == piece).sum(axis=1) * bitboard.piece_phases[piece]
+	return features, numpy.minimum(phase, bitboard.total_phase) / bitboard.total_phase
+
+
+def initialWeights():
+	# Columns follow the diagram order of the tables, and each holds the material value plus the table entry
+	weights = numpy.empty((2, 384), numpy.float64)
+	for x, (values, tables) in enumerate(((bitboard.middlegame_values, bitboard.middlegame_tables), (bitboard.endgame_values, bitboard.endgame_tables))):
+		for piece in range(6):
+			weights[x, piece * 64:(piece + 1) * 64] = values[piece] + numpy.array(tables[piece], numpy.float64)
+	return weights
+
+
+def evaluate(features, phase, weights, batch_size):
+	scores = numpy.empty(len(features), numpy.float64)
+	for start in range(0, len(features), batch_size):
+		batch = features[start:start + batch_size].astype(numpy.float32)
+		middlegame, endgame = batch @ weights[0], batch @ weights[1]
+		share = phase[start:start + batch_size]
+		scores[start:start + batch_size] = middlegame * share + endgame * (1 - share)
+	return scores
+
+
+def predictionError(scores, outcomes, scale):
+	return float(numpy.mean((outcomes - 1 / (1 + numpy.exp(-scale * scores))) ** 2))
+
+
+def fitScale(scores, outcomes):
+	"""Scale of the sigmoid that maps centipawns to expected results, fitted to the starting weights so that tuning only moves the weights"""
+	best = None
+	for scale in numpy.linspace(0.001, 0.02, 96):
+		error = predictionError(scores, outcomes, scale)
+		if best is None or error < best[0]:
+			best = (error, scale)
+	return best[1]
+
+
+def tune(features, phase, outcomes, weights, scale, epochs=200, learning_rate=2.0, batch_size=65536):
+	# Full-batch Adam, with the gradient of each batch accumulated as one matrix product per phase
+	moment, velocity = numpy.zeros_like(weights), numpy.zeros_like(weights)
+	for epoch in range(1, epochs + 1):
+		gradient = numpy.zeros_like(weights)
+		error = 0.0
+		for start in range(0, len(features), batch_size):
+			batch = features[start:start + batch_size].astype(numpy.float32)
+			share = phase[start:start + batch_size]
+			scores = (batch @ weights[0]) * share + (batch @ weights[1]) * (1 - share)
+			predicted = 1 / (1 + numpy.exp(-scale * scores))
+			residual = predicted - outcomes[start:start + batch_size]
+			error += float(numpy.sum(residual ** 2))
+			delta = residual * predicted * (1 - predicted) * scale
+			gradient[0] += batch.T @ (delta * share)
+			gradient[1] += batch.T @ (delta * (1 - share))
+		gradient *= 2 / len(features)
+		moment = 0.9 * moment + 0.1 * gradient
+		velocity = 0.999 * velocity + 0.001 * gradient ** 2
+		weights -= learning_rate * (moment / (1 - 0.9 ** epoch)) / (numpy.sqrt(velocity / (1 - 0.999 ** epoch)) + 1e-8)
+		weights[:, 5 * 64:] -= weights[:, 5 * 64:].mean(axis=1, keepdims=True)
+		if epoch == 1 or epoch % 10 == 0 or epoch == epochs:
+			print("epoch", str(epoch).rjust(4), "error", "%.6f" % (error / len(features)))
+	return weights
+
+
+def splitWeights(weights):
+	"""Material values and diagram-ordered tables, with each piece's average over the squares it can stand on taken as its material value"""
+	output = {}
+	for x, name in enumerate(("middlegame", "endgame")):
+		values, tables = [], []
+		for piece in range(6):
+			table = weights[x, piece * 64:(piece + 1) * 64]
+			squares = table[8:56] if piece == bitboard.pawn else table
+			value = 0 if piece == bitboard.king else int(round(squares.mean()))
+			table = numpy.rint(table - value).astype(int)
+			if piece == bitboard.pawn:
+				table[:8] = table[56:] = 0
+			values.append(value)
+			tables.append(table.tolist())
+		output[name + "_values"], output[name + "_tables"] = values, tables
+	return output
+
+
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description="Fit the piece-square evaluation to the results of games in PGN files")
+	parser.add_argument("pgn", nargs="+", help="PGN files to read games from")
+	parser.add_argument("--output", default="evaluation.json", help="weights file to write, loaded by the computer player through the evaluation-weights setting")
+	parser.add_argument("--epochs", type=int, default=200, help="number of gradient steps")
+	parser.add_argument("--learning-rate", type=float, default=2.0, help="step size in centipawns")
+	parser.add_argument("--limit", type=int, help="maximum number of positions to use")
+	parser.add_argument("--skip-plies", type=int, default=8, help="opening plies to leave out of each game")
+	parser.add_argument("--start", help="weights file to start from instead of the built-in tables")
+	arguments = parser.parse_args(arguments)
+	if arguments.start and not bitboard.loadEvaluation(arguments.start):
+		print("could not read weights from", arguments.start)
+		return 1
+	start = time.perf_counter()
+	boards, outcomes = extractPositions(arguments.pgn, arguments.skip_plies, arguments.limit)
+	if not len(boards):
+		print("no quiet positions found")
+		return 1
+	features, phase = buildFeatures(boards)
+	print(len(boards), "positions in", "%.1f" % (time.perf_counter() - start), "s")
+	weights = initialWeights()
+	scale = fitScale(evaluate(features, phase, weights, 65536), outcomes)
+	print("scale", "%.5f" % scale, "starting error", "%.6f" % predictionError(evaluate(features, phase, weights, 65536), outcomes, scale))
+	weights = tune(features, phase, outcomes, weights, scale, arguments.epochs, arguments.learning_rate)
+	with open(arguments.output, "w") as file:
+		json.dump(splitWeights(weights), file)
+	print("wrote", arguments.output, "in", "%.1f" % (time.perf_counter() - start), "s")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -6,6 +6,7 @@ twoplayers.py
 """
 
 import json
+import book
 import board
 import chess
 import asyncio
@@ -192,6 +193,7 @@ class TwoPlayers(QWidget):
 		self.opening.setWordWrap(True)
 		self.opening.setFont(QFont(QFontDatabase.applicationFontFamilies(QFontDatabase.addApplicationFont(QDir.currentPath() + "/fonts/ChakraPetch-Bold.ttf"))[0], 17, italic=True))
 		self.opening.resize(QSize(300, 50))
+		self.opening_labels = ["Starting Position"]
 		self.moves = QWidget()
 		self.moves_layout = QGridLayout()
 		self.moves_layout.setAlignment(Qt.AlignTop | Qt.AlignLeft)
@@ -248,6 +250,7 @@ class TwoPlayers(QWidget):
 				self.game = chess.Atomic()
 				self.game.loadPGN(position)
 		self.board = board.Board(self, self.game)
+		self.resetOpeningLabels()
 		self.sidebar.raise_()
 
 	def addTemporaryMove(self, text):
@@ -365,23 +368,23 @@ class TwoPlayers(QWidget):
 				self.clocks[0].start()
 
 	async def updateOpening(self):
-		position = self.game.FEN().split()[0]
-		for i in chess.openings.openings:
-			if i["position"] == position:
-				self.opening.setText(i["eco"] + " " + i["name"])
-				return
+		opening = book.getOpeningNames(chess.openings.openings).lookup(self.game)
+		self.opening_labels.append(opening or self.opening_labels[-1])
+		self.opening.setText(self.opening_labels[-1])
 
 	async def updateTakebackOpening(self):
-		game = chess.Game()
-		opening = "Starting Position"
-		for x in self.game.raw_move_list:
-			game.move(x.name, evaluate_checks=False, evaluate_move_checks=False, evaluate_move_checkmate=False)
-			position = game.FEN().split()[0]
-			for y in chess.openings.openings:
-				if y["position"] == position:
-					opening = y["eco"] + " " + y["name"]
-					break
-		self.opening.setText(opening)
+		del self.opening_labels[len(self.game.raw_move_list) + 1:]
+		self.opening.setText(self.opening_labels[-1])
+
+	def resetOpeningLabels(self):
+		# Moves loaded from a PGN are named once here, after that each move pushes a label and each takeback pops one
+		names = book.getOpeningNames(chess.openings.openings)
+		game = type(self.game)()
+		self.opening_labels = ["Starting Position"]
+		for i in self.game.raw_move_list:
+			game.move(i.name, evaluate_checks=False, evaluate_move_checks=False, evaluate_move_checkmate=False)
+			self.opening_labels.append(names.name(game.FEN().split()[0]) or self.opening_labels[-1])
+		self.opening.setText(self.opening_labels[-1])
 
 	def updateSettingsValues(self):
 		self.settings_values = json.load(open("settings.json"))
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+"""
+uci.py
+Asynchronous UCI Engine Communication
+"""
+
+import bitboard
+
+from PyQt5.QtCore import *
+
+closing_engines = set()
+engine_pool = None
+
+# Seconds a pooled engine has to answer isready before it is taken to be hung and shut down
+engine_start_timeout = 30
+
+info_integer_fields = ["depth", "seldepth", "time", "nodes", "multipv", "currmovenumber", "hashfull", "nps", "tbhits", "cpuload"]
+
+
+def parseInfo(tokens):
+	info = {}
+	index = 1
+	while index < len(tokens):
+		token = tokens[index]
+		if token in info_integer_fields and index + 1 < len(tokens):
+			try:
+				info[token] = int(tokens[index + 1])
+			except ValueError:
+				pass
+			index += 2
+		elif token == "score":
+			index += 1
+			while index < len(tokens) and tokens[index] in ["cp", "mate", "lowerbound", "upperbound"]:
+				if tokens[index] in ["lowerbound", "upperbound"]:
+					info["bound"] = tokens[index]
+					index += 1
+				elif index + 1 < len(tokens):
+					try:
+						info["score"] = (tokens[index], int(tokens[index + 1]))
+					except ValueError:
+						pass
+					index += 2
+				else:
+					index += 1
+		elif token == "currmove" and index + 1 < len(tokens):
+			info["currmove"] = tokens[index + 1]
+			index += 2
+		elif token == "pv":
+			info["pv"] = tokens[index + 1:]
+			break
+		elif token == "string":
+			info["string"] = " ".join(tokens[index + 1:])
+			break
+		else:
+			index += 1
+	return info
+
+
+def parseOption(tokens):
+	option = {}
+	key, values = None, []
+	for i in tokens[1:]:
+		if i in ["name", "type", "default", "min", "max", "var"]:
+			if key is not None:
+				option.setdefault(key, []).append(" ".join(values))
+			key, values = i, []
+		else:
+			values.append(i)
+	if key is not None:
+		option.setdefault(key, []).append(" ".join(values))
+	return {x: (y if x == "var" else y[0]) for x, y in option.items()}
+
+
+class Engine(QObject):
+	"""UCI engine process that reports its output through Qt signals instead of blocking reads"""
+	started = pyqtSignal()
+	initialized = pyqtSignal()
+	ready = pyqtSignal()
+	identified = pyqtSignal(str, str)
+	info = pyqtSignal(dict)
+	bestMove = pyqtSignal(str, str)
+	error = pyqtSignal(str)
+	line = pyqtSignal(str)
+
+	def __init__(self, path, parent=None):
+		super(Engine, self).__init__(parent)
+		self.path = path
+		self.name = self.author = ""
+		self.options = {}
+		self.uciok = False
+		self.queued_commands = []
+		self.buffer = b""
+		self.process = QProcess(self)
+		self.process.started.connect(self.processStarted)
+		self.process.readyReadStandardOutput.connect(self.readOutput)
+		self.process.errorOccurred.connect(self.processError)
+
+	def start(self):
+		self.process.start(self.path, [])
+
+	def disconnectClients(self):
+		for i in [self.started, self.initialized, self.ready, self.identified, self.info, self.bestMove, self.error, self.line]:
+			try:
+				i.disconnect()
+			except TypeError:
+				pass
+
+	def isRunning(self):
+		return self.process.state() != QProcess.NotRunning
+
+	def send(self, command):
+		if not self.uciok and command != "uci":
+			self.queued_commands.append(command)
+			return
+		self.process.write((command + "\n").encode())
+
+	def quit(self):
+		if not self.isRunning():
+			return
+		# Keep the engine alive on its own until the process exits, so closing a game never waits for it
+		self.setParent(None)
+		closing_engines.add(self)
+		self.process.finished.connect(lambda: closing_engines.discard(self))
+		self.process.write(b"quit\n")
+		self.process.closeWriteChannel()
+		self.kill_timer = QTimer(self)
+		self.kill_timer.setSingleShot(True)
+		self.kill_timer.timeout.connect(self.process.kill)
+		self.kill_timer.start(2000)
+
+	def processStarted(self):
+		self.started.emit()
+		self.send("uci")
+
+	def processError(self, error):
+		self.error.emit(self.process.errorString())
+
+	def readOutput(self):
+		self.buffer += bytes(self.process.readAllStandardOutput())
+		lines = self.buffer.split(b"\n")
+		self.buffer = lines.pop()
+		for i in lines:
+			self.parseLine(i.decode(errors="replace").strip())
+
+	def parseLine(self, text):
+		tokens = text.split()
+		if not tokens:
+			return
+		self.line.emit(text)
+		if tokens[0] == "info":
+			self.info.emit(parseInfo(tokens))
+		elif tokens[0] == "bestmove" and len(tokens) > 1:
+			self.bestMove.emit(tokens[1], tokens[3] if len(tokens) > 3 and tokens[2] == "ponder" else "")
+		elif tokens[0] == "readyok":
+			self.ready.emit()
+		elif tokens[0] == "id" and len(tokens) > 2:
+			if tokens[1] == "name":
+				self.name = " ".join(tokens[2:])
+			elif tokens[1] == "author":
+				self.author = " ".join(tokens[2:])
+			self.identified.emit(self.name, self.author)
+		elif tokens[0] == "option":
+			option = parseOption(tokens)
+			if "name" in option:
+				self.options[option["name"]] = option
+		elif tokens[0] == "uciok":
+			self.uciok = True
+			self.initialized.emit()
+			for i in self.queued_commands:
+				self.send(i)
+			self.queued_commands = []
+
+
+class Session:
+	"""One game against a UCI engine: ucinewgame is sent once and the position is sent as the start position plus the moves played"""
+	def __init__(self, engine, fen=None):
+		self.engine = engine
+		self.start_fen = fen
+		self.position = bitboard.Position(fen or bitboard.starting_fen)
+		self.moves = []
+		self.started = False
+
+	def push(self, fen):
+		position = " ".join(fen.split()[:3])
+		for move in self.position.moves():
+			self.position.make(move)
+			if " ".join(self.position.FEN().split()[:3]) == position:
+				self.moves.append(self.position.moveName(move))
+				return True
+			self.position.unmake()
+		return False
+
+	def truncate(self, length):
+		while len(self.moves) > length:
+			self.moves.pop()
+			self.position.unmake()
+
+	def positionCommand(self, extra_moves=()):
+		command = "position startpos" if self.start_fen is None else "position fen " + self.start_fen
+		moves = self.moves + list(extra_moves)
+		if moves:
+			command += " moves " + " ".join(moves)
+		return command
+
+	def go(self, command, ponder_move=None):
+		if not self.started:
+			self.engine.send("ucinewgame")
+			self.engine.send("isready")
+			self.started = True
+		self.engine.send(self.positionCommand([ponder_move] if ponder_move else []))
+		self.engine.send(command)
+
+
+class EnginePool(QObject):
+	"""Process-wide set of initialized engines, keyed by executable path, that are handed to new games instead of starting a new process"""
+	def __init__(self, warm_engines=1, max_engines=4, idle_timeout=300):
+		super(EnginePool, self).__init__()
+		self.warm_engines, self.max_engines, self.idle_timeout = warm_engines, max_engines, idle_timeout
+		self.idle = {}
+		self.starting = {}
+		self.in_use = set()
+		self.idle_since = {}
+		self.starting_since = {}
+		self.idle_timer = QTimer(self)
+		self.idle_timer.timeout.connect(self.closeIdleEngines)
+		self.idle_timer.start(10000)
+		QCoreApplication.instance().aboutToQuit.connect(self.shutdown)
+
+	def count(self):
+		return len(self.in_use) + sum(len(i) for i in self.idle.values()) + sum(len(i) for i in self.starting.values())
+
+	def acquire(self, path):
+		"""An engine for path, taken from the idle engines, then from those still starting, and only then started
+
+		max_engines caps the engines the pool keeps: to start a new one, idle and starting engines of other paths are shut down first. Engines in use are never taken from their games, so when every engine is in use the new game still gets its own process and the pool holds more than max_engines until some are released
+		"""
+		if self.idle.get(path):
+			engine = self.idle[path].pop()
+			del self.idle_since[engine]
+		elif self.starting.get(path):
+			# Engines that already passed uci are handed out first, since the game can use them straight away
+			engine = max(self.starting[path], key=lambda x: x.uciok)
+			self.removeStarting(engine)
+			engine.disconnectClients()
+		else:
+			self.makeRoom()
+			engine = Engine(path, self)
+			engine.start()
+		self.in_use.add(engine)
+		self.warmUp(path)
+		return engine
+
+	def release(self, engine):
+		self.in_use.discard(engine)
+		engine.disconnectClients()
+		if not engine.isRunning() or self.count() >= self.max_engines:
+			self.shutdownEngine(engine)
+			return
+		self.addStarting(engine)
+		engine.send("stop")
+		engine.send("ucinewgame")
+		engine.send("isready")
+
+	def warmUp(self, path):
+		while len(self.idle.get(path, [])) + len(self.starting.get(path, [])) < self.warm_engines and self.count() < self.max_engines:
+			engine = Engine(path, self)
+			self.addStarting(engine)
+			engine.start()
+			engine.send("isready")
+
+	def addStarting(self, engine):
+		# Until the engine answers isready it is only watched for that answer, a failure or the start timeout
+		self.starting.setdefault(engine.path, []).append(engine)
+		self.starting_since[engine] = QDateTime.currentSecsSinceEpoch()
+		engine.ready.connect(lambda engine=engine: self.engineReady(engine))
+		engine.error.connect(lambda _, engine=engine: self.engineFailed(engine))
+
+	def removeStarting(self, engine):
+		if engine in self.starting.get(engine.path, []):
+			self.starting[engine.path].remove(engine)
+			del self.starting_since[engine]
+			return True
+		return False
+
+	def engineReady(self, engine):
+		engine.disconnectClients()
+		if self.removeStarting(engine):
+			self.idle.setdefault(engine.path, []).append(engine)
+			self.idle_since[engine] = QDateTime.currentSecsSinceEpoch()
+
+	def engineFailed(self, engine):
+		self.removeStarting(engine)
+		self.shutdownEngine(engine)
+
+	def makeRoom(self):
+		for engine in sorted(self.idle_since, key=self.idle_since.get):
+			if self.count() < self.max_engines:
+				return
+			self.idle[engine.path].remove(engine)
+			del self.idle_since[engine]
+			self.shutdownEngine(engine)
+		for engine in sorted(self.starting_since, key=self.starting_since.get):
+			if self.count() < self.max_engines:
+				return
+			self.engineFailed(engine)
+
+	def closeIdleEngines(self):
+		now = QDateTime.currentSecsSinceEpoch()
+		for engine, since in list(self.idle_since.items()):
+			if now - since >= self.idle_timeout:
+				self.idle[engine.path].remove(engine)
+				del self.idle_since[engine]
+				self.shutdownEngine(engine)
+		for engine, since in list(self.starting_since.items()):
+			if now - since >= engine_start_timeout:
+				self.engineFailed(engine)
+
+	@staticmethod
+	def shutdownEngine(engine):
+		engine.disconnectClients()
+		engine.quit()
+
+	def shutdown(self):
+		self.idle_timer.stop()
+		engines = list(self.in_use) + [x for y in self.idle.values() for x in y] + [x for y in self.starting.values() for x in y]
+		self.in_use, self.idle, self.starting, self.idle_since, self.starting_since = set(), {}, {}, {}, {}
+		for i in engines + list(closing_engines):
+			if i.isRunning():
+				i.process.write(b"quit\n")
+				if not i.process.waitForFinished(500):
+					i.process.kill()
+
+
+def getEnginePool(warm_engines=1, max_engines=4, idle_timeout=300):
+	global engine_pool
+	if engine_pool is None:
+		engine_pool = EnginePool(warm_engines, max_engines, idle_timeout)
+	return engine_pool